@@ -1,17 +1,16 @@
 # agent_app.py - AI Agent Version
 import streamlit as st
-from main import research
+from main import research_report, render_report, CITATION_STYLES, CREDIBILITY_ICONS
+from report_document import generate_pdf_report, markdown_to_html, submit_pdf_report, export_conversation, remove_stale_exports, EXPORT_PREFIX
+from intent import analyze_user_intent, extract_research_topic
+from profiling import StageProfiler
+from prewarm import CachePrewarmer
 import time
 import os
+import tempfile
 from dotenv import load_dotenv
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib.colors import HexColor
 import re
 from datetime import datetime
-import io
 
 # Load environment variables
 load_dotenv()
@@ -20,109 +19,6 @@ load_dotenv()
 from groq import Groq
 groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
-def generate_pdf_report(research_content, topic, user_query):
-    """Generate a professional PDF report from research content"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Get styles
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Title'],
-        fontSize=20,
-        spaceAfter=30,
-        textColor=HexColor('#1f4e79'),
-        alignment=1  # Center alignment
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading1'],
-        fontSize=14,
-        spaceAfter=12,
-        textColor=HexColor('#2c5aa0'),
-        keepWithNext=1
-    )
-    
-    subheading_style = ParagraphStyle(
-        'CustomSubHeading',
-        parent=styles['Heading2'],
-        fontSize=12,
-        spaceAfter=8,
-        textColor=HexColor('#4472c4'),
-        keepWithNext=1
-    )
-    
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontSize=10,
-        spaceAfter=8,
-        leading=14
-    )
-    
-    # Content list
-    content = []
-    
-    # Clean the topic title first
-    clean_topic = re.sub(r"I'll research \*\*'([^']+)'\*\* for yo.*", r'\1', topic)
-    clean_topic = re.sub(r'[^\w\s-]', '', clean_topic).strip()
-    if not clean_topic or len(clean_topic) < 3:
-        clean_topic = "Research Report"
-    
-    # Title page
-    content.append(Paragraph(f"Research Report", title_style))
-    content.append(Spacer(1, 12))
-    content.append(Paragraph(f"{clean_topic}", heading_style))
-    content.append(Spacer(1, 30))
-    
-    # Metadata
-    meta_style = ParagraphStyle('Meta', parent=styles['Normal'], fontSize=9, textColor=HexColor('#666666'))
-    content.append(Paragraph(f"Generated by AI Research Agent", meta_style))
-    content.append(Paragraph(f"Date: {datetime.now().strftime('%B %d, %Y')}", meta_style))
-    content.append(Spacer(1, 40))
-    
-    # Clean and format the research content
-    # Remove HTML tags and format for PDF
-    clean_content = re.sub(r'<[^>]+>', '', research_content)
-    clean_content = re.sub(r'\*\*(.*?)\*\*', r'\1', clean_content)  # Remove markdown bold
-    clean_content = re.sub(r'\*(.*?)\*', r'\1', clean_content)      # Remove markdown italic
-    clean_content = re.sub(r'#{1,6}\s*', '', clean_content)        # Remove markdown headers
-    
-    # Split content into sections
-    sections = clean_content.split('\n\n')
-    
-    for section in sections:
-        if section.strip():
-            # Check if it's a heading (starts with #)
-            if section.strip().startswith('#'):
-                heading_text = section.strip().lstrip('#').strip()
-                if len(heading_text) > 0:
-                    content.append(Paragraph(heading_text, heading_style))
-                    content.append(Spacer(1, 12))
-            # Check if it's a subheading or bullet point
-            elif section.strip().startswith('-') or section.strip().startswith('•'):
-                bullet_text = section.strip().lstrip('-•').strip()
-                if len(bullet_text) > 0:
-                    content.append(Paragraph(f"• {bullet_text}", body_style))
-            else:
-                # Regular paragraph
-                if len(section.strip()) > 0:
-                    content.append(Paragraph(section.strip(), body_style))
-                    content.append(Spacer(1, 8))
-    
-    # Footer
-    content.append(Spacer(1, 30))
-    content.append(Paragraph("Generated by AI Research Agent - Comprehensive Multi-Perspective Analysis", styles['Italic']))
-    
-    # Build PDF
-    doc.build(content)
-    buffer.seek(0)
-    return buffer
-
 # Page configuration
 st.set_page_config(
     page_title="AI Research Agent",
@@ -131,6 +27,25 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def start_cache_prewarmer():
+    """Start one pre-warmer per server process, shared by every session"""
+    prewarmer = CachePrewarmer()
+    prewarmer.start()
+    return prewarmer
+
+@st.cache_resource
+def clean_up_exports():
+    """Remove exports abandoned by earlier sessions, once per server process"""
+    remove_stale_exports()
+    return True
+
+clean_up_exports()
+
+# Set CACHE_PREWARM=0 to skip pre-warming (e.g. in tests or to save API quota)
+if os.getenv("CACHE_PREWARM", "1") != "0":
+    start_cache_prewarmer()
+
 # Initialize session state for conversation
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -275,77 +190,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def analyze_user_intent(message):
-    """Analyze user message to determine if research is needed"""
-    message_lower = message.lower().strip()
-    
-    # More specific intent recognition
-    greeting_words = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
-    
-    # Capability/question patterns - more comprehensive
-    question_patterns = [
-        'what can you do', 'what are your capabilities', 'how do you work', 
-        'what is this', 'help me', 'what are you', 'who are you',
-        'explain yourself', 'tell me about yourself', 'your features',
-        'what else can you do', 'what other things can you do',
-        'what are your skills', 'what functions do you have',
-        'how can you help', 'what services do you provide'
-    ]
-    
-    # Research trigger words - explicit research requests
-    research_triggers = [
-        'research', 'tell me about', 'find information about',
-        'analyze', 'investigate', 'study', 'explore the topic of',
-        'gather information', 'look up', 'search for'
-    ]
-    
-    clarification_words = ['tell me more', 'explain further', 'clarify', 'expand on', 'more details']
-    
-    # Check for greetings
-    if any(word in message_lower for word in greeting_words):
-        return "GREETING"
-    
-    # Check for capability questions first (more specific)
-    elif any(phrase in message_lower for phrase in question_patterns):
-        return "QUESTION"
-    
-    # Check for clarification requests
-    elif any(phrase in message_lower for phrase in clarification_words):
-        return "CLARIFICATION"
-    
-    # Check for explicit research triggers
-    elif any(trigger in message_lower for trigger in research_triggers):
-        return "RESEARCH"
-    
-    # For ambiguous cases, default to QUESTION to be safe
-    else:
-        return "QUESTION"
-
-def extract_research_topic(message):
-    """Extract the actual research topic from user message"""
-    message_lower = message.lower().strip()
-    
-    # Remove common research prefixes
-    prefixes_to_remove = [
-        'tell me about ', 'research ', 'find information about ',
-        'analyze ', 'investigate ', 'study ', 'explore ',
-        'gather information about ', 'look up ', 'search for ',
-        'what is ', 'what are ', 'who is ', 'who are ',
-        'how does ', 'how do ', 'why does ', 'why do '
-    ]
-    
-    cleaned_message = message
-    for prefix in prefixes_to_remove:
-        if message_lower.startswith(prefix):
-            cleaned_message = message[len(prefix):].strip()
-            break
-    
-    # Capitalize first letter for better presentation
-    if cleaned_message:
-        cleaned_message = cleaned_message[0].upper() + cleaned_message[1:]
-    
-    return cleaned_message if cleaned_message else message
-
 def generate_agent_response(message, intent, context=""):
     """Generate conversational response based on intent"""
     if intent == "GREETING":
@@ -373,6 +217,66 @@ What would you like to know or research?"""
         topic = extract_research_topic(message)
         return f"I'll research **'{topic}'** for you. Let me gather comprehensive information from multiple angles and provide you with well-sourced, fact-checked insights."
 
+def stream_research_progress(progress_bar, live_sources):
+    """Build an event handler that fills in the progress bar and source list live"""
+    state = {"planned": 1, "sources": [], "duplicates": 0}
+    
+    def on_event(event):
+        if event["type"] == "queries":
+            state["planned"] = max(len(event["queries"]), 1)
+            progress_bar.progress(5, text=f"Searching {state['planned']} perspectives...")
+        elif event["type"] == "source":
+            if event["duplicate"]:
+                state["duplicates"] += 1
+            else:
+                credibility = event["credibility"]
+                icon = CREDIBILITY_ICONS[credibility["level"]]
+                state["sources"].append(
+                    f"- {icon} [{event['title']}]({event['url']}) · {credibility['domain']} · score {credibility['score']}"
+                )
+            done = min(event["searches"] / state["planned"], 1.0)
+            progress_bar.progress(5 + int(done * 70), text=f"Found {len(state['sources'])} sources so far...")
+            lines = "\n".join(state["sources"])
+            if state["duplicates"]:
+                lines += f"\n\n_{state['duplicates']} duplicate results skipped_"
+            live_sources.markdown(f"**Sources found so far:**\n\n{lines}")
+        elif event["type"] == "stage":
+            if event["stage"] == "fact_check":
+                progress_bar.progress(80, text=f"Cross-checking facts across {event['sources']} sources...")
+            else:
+                progress_bar.progress(90, text="Writing the research summary...")
+    
+    return on_event
+
+def conversation_reports(messages, citation_style):
+    """Map message index to (report markdown, topic, user query) for every research result"""
+    reports = {}
+    for i, message in enumerate(messages):
+        if "research" in message:
+            # The previous message announces the research and names the topic
+            user_query = messages[i - 1].get("content", "Research Query") if i > 0 else "Research Query"
+            # Sources are stored with every citation style, so only the text is re-rendered
+            reports[i] = (render_report(message["research"], citation_style), user_query, user_query)
+    return reports
+
+def remove_export_file():
+    """Delete this session's prepared export, if any"""
+    st.session_state.pop("export_job", None)
+    export_path = st.session_state.pop("export_path", None)
+    if export_path and os.path.exists(export_path):
+        os.remove(export_path)
+
+def pending_pdf_jobs():
+    """This session's PDF builds still running - report PDFs and the conversation export"""
+    jobs = list(st.session_state.get("pdf_jobs", {}).values()) + [st.session_state.get("export_job")]
+    return [job for job in jobs if job is not None and not job.done()]
+
+@st.fragment(run_every=1)
+def refresh_when_pdfs_ready():
+    """Poll the PDF builds still running and rerun the app once all are ready"""
+    if not pending_pdf_jobs():
+        st.rerun()
+
 # Header
 st.markdown('<h1 class="main-header">AI Research Agent</h1>', unsafe_allow_html=True)
 st.markdown('<p class="subtitle">Your intelligent research companion with memory and conversation</p>', unsafe_allow_html=True)
@@ -383,10 +287,55 @@ with st.sidebar:
     
     citation_style = st.selectbox(
         "Citation Style",
-        ["APA", "MLA", "Simple"],
-        help="Choose your preferred academic citation format"
+        CITATION_STYLES,
+        help="Choose your preferred academic citation format - existing reports are restyled instantly"
+    )
+    
+    latency_budget = st.select_slider(
+        "⏱️ Latency Budget",
+        options=["No limit", "5 s", "10 s", "20 s", "30 s"],
+        help="Finish research within this time - stages are skipped or shortened to fit, and the report lists what was cut"
+    )
+    deadline = None if latency_budget == "No limit" else float(latency_budget.split()[0])
+    
+    profile_pipeline = st.checkbox(
+        "⏱️ Profile Pipeline",
+        help="Record CPU and memory profiles for each research stage (written to the profiles folder)"
     )
     
+    reports = conversation_reports(st.session_state.messages, citation_style)
+    if reports:
+        st.markdown("## 📦 Export Conversation")
+        export_format = st.radio("Export format", ["Combined PDF", "ZIP of PDFs"], horizontal=True)
+        if st.button("Prepare Export", use_container_width=True):
+            extension = "pdf" if export_format == "Combined PDF" else "zip"
+            # A private file per session - other sessions never see or overwrite it
+            remove_export_file()
+            remove_stale_exports()
+            export_fd, export_path = tempfile.mkstemp(prefix=EXPORT_PREFIX, suffix=f".{extension}")
+            os.close(export_fd)
+            st.session_state.export_path = export_path
+            st.session_state.export_name = f"research_conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+            # Built in the background; the refresh fragment reruns the app once it is ready
+            st.session_state.export_job = export_conversation(list(reports.values()), export_path, extension)
+        export_job = st.session_state.get("export_job")
+        export_path = st.session_state.get("export_path")
+        if export_job is not None and not export_job.done():
+            st.caption(f"⏳ Rendering {len(reports)} report{'s' if len(reports) > 1 else ''}...")
+        elif export_job is not None and export_job.exception():
+            st.caption(f"Export unavailable: {export_job.exception()}")
+        elif export_path and os.path.exists(export_path):
+            with open(export_path, "rb") as export_file:
+                # The button keeps its own copy of the data, so the file goes once downloaded
+                st.download_button(
+                    label="⬇️ Download Conversation",
+                    data=export_file,
+                    file_name=st.session_state.export_name,
+                    mime="application/pdf" if export_path.endswith(".pdf") else "application/zip",
+                    on_click=remove_export_file,
+                    use_container_width=True
+                )
+    
     st.markdown("## 🧠 Agent Capabilities")
     st.markdown("- **Conversational Interface** - Natural chat interaction")
     st.markdown("- **Memory & Context** - Remembers our conversation")
@@ -398,11 +347,19 @@ with st.sidebar:
     if st.button("🗑️ Clear Conversation"):
         st.session_state.messages = []
         st.session_state.conversation_context = ""
+        remove_export_file()
         st.rerun()
 
 # Chat interface
 st.markdown("## Chat with Your Research Agent")
 
+# Start building every report PDF in the worker pool before rendering, so they build in parallel
+pdf_jobs = st.session_state.get("pdf_jobs", {})
+st.session_state.pdf_jobs = {
+    hash(report_markdown): pdf_jobs.get(hash(report_markdown)) or submit_pdf_report(report_markdown, topic, user_query)
+    for report_markdown, topic, user_query in reports.values()
+}
+
 # Display conversation history
 for i, message in enumerate(st.session_state.messages):
     if message["role"] == "user":
@@ -413,16 +370,8 @@ for i, message in enumerate(st.session_state.messages):
         </div>
         ''', unsafe_allow_html=True)
     else:
-        # Format agent message content properly
-        content = message["content"]
-        
-        # Handle bold text with regex
-        import re
-        content = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', content)
-        # Handle code blocks
-        content = re.sub(r'`([^`]+)`', r'<code>\1</code>', content)
-        # Handle line breaks
-        content = content.replace('\n', '<br>')
+        # Render agent message from the cached document model
+        content = markdown_to_html(message["content"])
         
         st.markdown(f'''
         <div class="chat-message agent-message">
@@ -432,39 +381,43 @@ for i, message in enumerate(st.session_state.messages):
         ''', unsafe_allow_html=True)
         
         # Display research results if available
-        if "research_report" in message:
+        if i in reports:
+            report_markdown, topic, user_query = reports[i]
             with st.expander("📊 Research Results", expanded=True):
-                st.markdown(message["research_report"], unsafe_allow_html=True)
+                st.markdown(markdown_to_html(report_markdown), unsafe_allow_html=True)
+                
+                # Note which stages were cut to meet the latency budget
+                for step in message["research"].get("degraded", []):
+                    st.caption(f"⏱️ Shortened to meet the latency budget - {step['stage'].replace('_', ' ')}: {step['detail']}")
                 
                 # Add single PDF download button
                 st.markdown("<br>", unsafe_allow_html=True)
                 
-                # Extract topic and user query for PDF
-                topic = "Research Report"
-                user_query = "Research Query"
-                
-                # Try to extract topic from conversation context
-                if hasattr(st.session_state, 'messages') and len(st.session_state.messages) >= 2:
-                    for i, msg in enumerate(st.session_state.messages):
-                        if msg == message and i > 0:
-                            user_query = st.session_state.messages[i-1].get('content', 'Research Query')
-                            # Extract clean topic from user query
-                            topic = user_query
-                            break
-                
-                # Generate PDF
-                pdf_buffer = generate_pdf_report(message["research_report"], topic, user_query)
-                
-                # Single download button
-                st.download_button(
-                    label="📄 Download Professional PDF Report",
-                    data=pdf_buffer.getvalue(),
-                    file_name=f"research_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                    mime="application/pdf",
-                    key=f"download_pdf_{hash(message['research_report'])}",
-                    type="secondary",
-                    use_container_width=True
-                )
+                # Single download button - shown once the worker pool has built the PDF
+                pdf_job = st.session_state.pdf_jobs[hash(report_markdown)]
+                if not pdf_job.done():
+                    st.caption("⏳ Preparing PDF report...")
+                elif pdf_job.exception():
+                    st.caption(f"PDF report unavailable: {pdf_job.exception()}")
+                else:
+                    st.download_button(
+                        label="📄 Download Professional PDF Report",
+                        data=pdf_job.result(),
+                        file_name=f"research_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                        mime="application/pdf",
+                        key=f"download_pdf_{hash(report_markdown)}",
+                        type="secondary",
+                        use_container_width=True
+                    )
+        
+        if "profile" in message:
+            with st.expander("⏱️ Pipeline Profile", expanded=False):
+                st.code(message["profile"], language=None)
+                st.caption(f"cProfile (.prof) and allocation flamegraph (.alloc.folded) files written to {message['profile_dir']}")
+
+# Rerun once the PDFs still building are ready, without blocking this run
+if pending_pdf_jobs():
+    refresh_when_pdfs_ready()
 
 # Research mode toggle
 st.markdown("---")
@@ -476,13 +429,10 @@ if st.session_state.get('research_in_progress', False) and st.session_state.get(
     </div>
     ''', unsafe_allow_html=True)
     
-    # Add visual progress bar
-    progress_bar = st.progress(0)
-    for i in range(100):
-        progress_bar.progress(i + 1)
-        time.sleep(0.02)  # Fast smooth progress
+    # Progress bar and live source list, filled in by pipeline events below
+    progress_bar = st.progress(0, text="Planning search perspectives...")
+    live_sources = st.empty()
     
-    # The actual research will continue after this visual feedback
     user_input = None  # No input during research
 else:
     # Show input area only when not researching
@@ -546,7 +496,7 @@ if st.session_state.messages and len(st.session_state.messages) >= 2:
     last_message = st.session_state.messages[-1]
     if (last_message["role"] == "assistant" and 
         "I'll research" in last_message["content"] and 
-        "research_report" not in last_message):
+        "research" not in last_message):
         
         # Extract the research topic from the message
         import re
@@ -565,9 +515,10 @@ if st.session_state.messages and len(st.session_state.messages) >= 2:
                 st.session_state.research_started = True
                 st.rerun()  # Rerun to show progress bar
             
+            profiler = StageProfiler(os.path.join("profiles", datetime.now().strftime('%Y%m%d_%H%M%S'))) if profile_pipeline else None
             try:
                 # Run research with the original user input (this happens after progress shows)
-                report = research(user_message, citation_style)
+                report = research_report(user_message, on_event=stream_research_progress(progress_bar, live_sources), profiler=profiler, deadline=deadline)
                 
                 # Clear research state
                 st.session_state.research_in_progress = False
@@ -575,11 +526,19 @@ if st.session_state.messages and len(st.session_state.messages) >= 2:
                 
                 # Add research results
                 result_message = f"Research completed! Here are my findings on **'{research_topic}'**:"
-                st.session_state.messages.append({
+                result = {
                     "role": "assistant", 
                     "content": result_message,
-                    "research_report": report
-                })
+                    "research": report
+                }
+                if profiler:
+                    # Include the PDF export in the profile, since every report renders one
+                    with profiler.stage('pdf'):
+                        generate_pdf_report(render_report(report, citation_style), user_message, user_message)
+                    profiler.write()
+                    result["profile"] = profiler.summary()
+                    result["profile_dir"] = profiler.output_dir
+                st.session_state.messages.append(result)
                 
                 # Update context
                 st.session_state.conversation_context += f" Agent researched {research_topic} and provided comprehensive findings."
@@ -594,6 +553,10 @@ if st.session_state.messages and len(st.session_state.messages) >= 2:
                 error_response = f"I encountered an issue while researching **'{research_topic}'**. Please check your API keys and try again. Error: {str(e)}"
                 st.session_state.messages.append({"role": "assistant", "content": error_response})
                 st.rerun()
+            finally:
+                # Stop memory tracing even when the research failed
+                if profiler:
+                    profiler.close()
     
 
 
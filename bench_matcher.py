@@ -0,0 +1,125 @@
+# bench_matcher.py - Micro-benchmark for the compiled phrase matcher
+#
+# Compares the compiled PhraseMatcher against the plain any(phrase in text)
+# chains it replaced, for the shipped intent tables and for synthetic tables
+# grown into the thousands of phrases. Before timing anything it checks that
+# labels, word_matches and match_prefix agree with naive reference versions.
+#
+# Usage: python bench_matcher.py [--sizes 40 1000 5000] [--repeat 5] [--check-only]
+import argparse
+import random
+import string
+import timeit
+from matcher import PhraseMatcher
+from intent import INTENT_MATCHER, INTENT_PRIORITY, GREETING_WORDS, QUESTION_PATTERNS, CLARIFICATION_WORDS, RESEARCH_TRIGGERS
+
+SAMPLE_MESSAGES = [
+    "Hello, what can you do?",
+    "Research Tesla vs competitors",
+    "Tell me about AI ethics",
+    "Can you expand on the battery supply chain findings from before?",
+    "I am curious how remote work changed productivity in small startups over the last decade",
+]
+
+def naive_labels(tables, text):
+    """Reference implementation - one substring pass per phrase"""
+    return {label for label, phrases in tables.items() if any(phrase in text for phrase in phrases)}
+
+def naive_word_matches(tables, text):
+    """Reference word_matches - every occurrence of every phrase, kept on word boundaries"""
+    matches = []
+    for label, phrases in tables.items():
+        for phrase in phrases:
+            start = text.find(phrase)
+            while start != -1:
+                end = start + len(phrase)
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    matches.append((start, end, label))
+                start = text.find(phrase, start + 1)
+    return sorted(matches)
+
+def naive_match_prefix(tables, text):
+    """Reference match_prefix - the first phrase in table order that text starts with"""
+    for phrases in tables.values():
+        for phrase in phrases:
+            if text.startswith(phrase):
+                return phrase
+    return None
+
+# Phrases that nest, overlap and share prefixes across labels, so the
+# failure links and output inheritance of the automaton are exercised
+OVERLAP_TABLES = {
+    "A": ["he", "hers", "research", "search"],
+    "B": ["she", "his", "re", "researcher"],
+    "C": ["her", "ear", "a", "search engine"],
+}
+OVERLAP_TEXTS = [
+    "", "a", "she", "ushers", "hishers", "researcher", "research", "researchers",
+    "her research", "the search engine", "search-engine", "re: her", "ahe hers", "aaaa",
+]
+
+def check_equivalence(cases, seed=0, samples=300):
+    """Assert the matcher agrees with the naive versions on fixed and random texts"""
+    rnd = random.Random(seed)
+    for name, tables, matcher in cases:
+        phrases = [phrase for table in tables.values() for phrase in table]
+        texts = [message.lower() for message in SAMPLE_MESSAGES] + OVERLAP_TEXTS + phrases[:50]
+        # Random texts stitched from phrase fragments and separators hit
+        # partial matches, overlaps and word-boundary edges
+        for _ in range(samples):
+            parts = [rnd.choice(phrases)[:rnd.randint(1, 12)] for _ in range(rnd.randint(1, 5))]
+            texts.append(''.join(part + rnd.choice(['', ' ', '-', 's', ', ']) for part in parts))
+        for text in texts:
+            assert matcher.labels(text) == naive_labels(tables, text), (name, text)
+            assert sorted(matcher.word_matches(text)) == naive_word_matches(tables, text), (name, text)
+            assert matcher.match_prefix(text) == naive_match_prefix(tables, text), (name, text)
+        print(f"{name}: matcher agrees with naive on {len(texts)} texts")
+
+def synthetic_tables(size, seed=0):
+    """Build labelled tables holding `size` random multi-word phrases in total"""
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(3, 8))) for _ in range(2000)]
+    tables = {label: [] for label in INTENT_PRIORITY}
+    for i in range(size):
+        phrase = ' '.join(rnd.choice(words) for _ in range(rnd.randint(1, 3)))
+        tables[INTENT_PRIORITY[i % len(INTENT_PRIORITY)]].append(phrase)
+    return tables
+
+def time_per_message(func, repeat):
+    """Return the best average microseconds per message over `repeat` runs"""
+    messages = [message.lower() for message in SAMPLE_MESSAGES]
+    number = 200
+    timings = timeit.repeat(lambda: [func(message) for message in messages], number=number, repeat=repeat)
+    return min(timings) / (number * len(messages)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled phrase matcher")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000], help="synthetic table sizes to test")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions per case")
+    parser.add_argument("--check-only", action="store_true", help="run the equivalence check without timing")
+    args = parser.parse_args()
+
+    shipped_tables = {
+        "GREETING": GREETING_WORDS,
+        "QUESTION": QUESTION_PATTERNS,
+        "CLARIFICATION": CLARIFICATION_WORDS,
+        "RESEARCH": RESEARCH_TRIGGERS,
+    }
+    cases = [("shipped", shipped_tables, INTENT_MATCHER), ("overlap", OVERLAP_TABLES, PhraseMatcher(OVERLAP_TABLES))]
+    for size in args.sizes:
+        tables = synthetic_tables(size)
+        cases.append((f"synthetic-{size}", tables, PhraseMatcher(tables)))
+
+    check_equivalence(cases)
+    if args.check_only:
+        return
+
+    print(f"{'tables':<16}{'phrases':>9}{'naive us/msg':>15}{'compiled us/msg':>18}{'speedup':>10}")
+    for name, tables, matcher in cases:
+        naive = time_per_message(lambda text: naive_labels(tables, text), args.repeat)
+        compiled = time_per_message(matcher.labels, args.repeat)
+        phrases = sum(len(phrases) for phrases in tables.values())
+        print(f"{name:<16}{phrases:>9}{naive:>15.2f}{compiled:>18.2f}{naive / compiled:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# compression.py - Extractive sentence-level compression of source content
+import re
+import math
+import hashlib
+from collections import Counter
+from matcher import PhraseMatcher
+
+# Rough size of a LLaMA token in English text, for reporting savings
+CHARS_PER_TOKEN = 4
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+|\s*[|•»]\s*")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Navigation, consent and promotion text that carries no research value
+BOILERPLATE_PHRASES = [
+    'cookie', 'cookies', 'we use cookies', 'this site uses cookies', 'this website uses cookies', 'accept all', 'privacy policy', 'terms of service', 'terms of use',
+    'all rights reserved', 'sign in', 'sign up', 'log in', 'subscribe',
+    'newsletter', 'skip to content', 'skip to main', 'click here', 'read more',
+    'advertisement', 'share this', 'follow us', 'enable javascript',
+    'your browser', 'related articles', 'recommended for you', 'back to top',
+]
+BOILERPLATE_MATCHER = PhraseMatcher({"boilerplate": BOILERPLATE_PHRASES})
+
+# Navigation and consent text comes in short fragments that open with the
+# phrase ("Sign in to continue", "Share this article"). A phrase met inside
+# a sentence ("market share this year", "two million subscribers") is content.
+BOILERPLATE_MAX_WORDS = 12
+LEADING_NOISE = " \t-–—>|•*#(["
+
+# Very common words that say nothing about how informative a sentence is
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that the
+this to was were will with they their which who what when where how also more
+""".split())
+
+MIN_SENTENCE_WORDS = 5
+
+def split_sentences(text):
+    """Split source text into trimmed sentences"""
+    return [sentence.strip() for sentence in SENTENCE_SPLIT.split(text) if sentence and sentence.strip()]
+
+def is_boilerplate(sentence, words):
+    """True for a short fragment that opens with a whole-word boilerplate phrase"""
+    if len(words) > BOILERPLATE_MAX_WORDS:
+        return False
+    text = sentence.lower().lstrip(LEADING_NOISE)
+    return any(start == 0 for start, _, _ in BOILERPLATE_MATCHER.word_matches(text))
+
+def sentence_key(words):
+    """Hash of the normalized sentence, used to spot repeats across sources"""
+    return hashlib.blake2b(" ".join(words).encode(), digest_size=8).digest()
+
+def compress_sources(results, ratio=0.5):
+    """Keep the most informative sentences of each source, up to `ratio` of its length
+
+    Boilerplate, short fragments and sentences already seen in another
+    source are dropped first. The remaining sentences are scored by how
+    rare their words are across all sources and the best ones are kept in
+    their original order.
+    Returns (compressed results, stats); the input results are not modified.
+    """
+    seen = set()
+    candidates = []
+    document_frequency = Counter()
+    dropped_boilerplate = dropped_duplicates = 0
+
+    for result in results:
+        kept = []
+        for sentence in split_sentences(result['content']):
+            words = WORD_PATTERN.findall(sentence.lower())
+            if len(words) < MIN_SENTENCE_WORDS or is_boilerplate(sentence, words):
+                dropped_boilerplate += 1
+                continue
+            key = sentence_key(words)
+            if key in seen:
+                dropped_duplicates += 1
+                continue
+            seen.add(key)
+            content_words = {word for word in words if word not in STOP_WORDS}
+            document_frequency.update(content_words)
+            kept.append((sentence, content_words, len(words)))
+        candidates.append(kept)
+
+    total_sentences = max(sum(len(kept) for kept in candidates), 1)
+    compressed = []
+    original_chars = compressed_chars = 0
+    for result, kept in zip(results, candidates):
+        # Rare words and figures carry the most information per sentence
+        scored = []
+        for index, (sentence, content_words, length) in enumerate(kept):
+            information = sum(math.log(total_sentences / document_frequency[word]) + 1 for word in content_words)
+            if any(char.isdigit() for char in sentence):
+                information *= 1.2
+            scored.append((information / math.sqrt(length), index))
+
+        budget = len(result['content']) * ratio
+        selected = []
+        used = 0
+        for _, index in sorted(scored, reverse=True):
+            sentence = kept[index][0]
+            # Kept sentences are joined with single spaces
+            length = len(sentence) + (1 if selected else 0)
+            if selected and used + length > budget:
+                continue
+            selected.append(index)
+            used += length
+
+        content = " ".join(kept[index][0] for index in sorted(selected))
+        original_chars += len(result['content'])
+        compressed_chars += len(content)
+        compressed.append({**result, 'content': content})
+
+    stats = {
+        'original_chars': original_chars,
+        'compressed_chars': compressed_chars,
+        'ratio': compressed_chars / original_chars if original_chars else 1.0,
+        'tokens_saved': (original_chars - compressed_chars) // CHARS_PER_TOKEN,
+        'dropped_boilerplate': dropped_boilerplate,
+        'dropped_duplicates': dropped_duplicates,
+    }
+    return compressed, stats
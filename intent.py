@@ -0,0 +1,71 @@
+# intent.py - Intent routing and topic extraction for the chat agent
+from matcher import PhraseMatcher
+
+# More specific intent recognition
+GREETING_WORDS = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
+
+# Capability/question patterns - more comprehensive
+QUESTION_PATTERNS = [
+    'what can you do', 'what are your capabilities', 'how do you work',
+    'what is this', 'help me', 'what are you', 'who are you',
+    'explain yourself', 'tell me about yourself', 'your features',
+    'what else can you do', 'what other things can you do',
+    'what are your skills', 'what functions do you have',
+    'how can you help', 'what services do you provide'
+]
+
+# Research trigger words - explicit research requests
+RESEARCH_TRIGGERS = [
+    'research', 'tell me about', 'find information about',
+    'analyze', 'investigate', 'study', 'explore the topic of',
+    'gather information', 'look up', 'search for'
+]
+
+CLARIFICATION_WORDS = ['tell me more', 'explain further', 'clarify', 'expand on', 'more details']
+
+# Common research prefixes removed from the topic
+RESEARCH_PREFIXES = [
+    'tell me about ', 'research ', 'find information about ',
+    'analyze ', 'investigate ', 'study ', 'explore ',
+    'gather information about ', 'look up ', 'search for ',
+    'what is ', 'what are ', 'who is ', 'who are ',
+    'how does ', 'how do ', 'why does ', 'why do '
+]
+
+# Intents in priority order - the first one with a matching phrase wins
+INTENT_PRIORITY = ["GREETING", "QUESTION", "CLARIFICATION", "RESEARCH"]
+
+# Compiled once at import, so each message is scanned a single time
+INTENT_MATCHER = PhraseMatcher({
+    "GREETING": GREETING_WORDS,
+    "QUESTION": QUESTION_PATTERNS,
+    "CLARIFICATION": CLARIFICATION_WORDS,
+    "RESEARCH": RESEARCH_TRIGGERS,
+})
+PREFIX_MATCHER = PhraseMatcher({"PREFIX": RESEARCH_PREFIXES})
+
+def analyze_user_intent(message):
+    """Analyze user message to determine if research is needed"""
+    found = INTENT_MATCHER.labels(message.lower().strip())
+
+    for intent in INTENT_PRIORITY:
+        if intent in found:
+            return intent
+
+    # For ambiguous cases, default to QUESTION to be safe
+    return "QUESTION"
+
+def extract_research_topic(message):
+    """Extract the actual research topic from user message"""
+    message_lower = message.lower().strip()
+
+    cleaned_message = message
+    prefix = PREFIX_MATCHER.match_prefix(message_lower)
+    if prefix:
+        cleaned_message = message[len(prefix):].strip()
+
+    # Capitalize first letter for better presentation
+    if cleaned_message:
+        cleaned_message = cleaned_message[0].upper() + cleaned_message[1:]
+
+    return cleaned_message if cleaned_message else message
@@ -0,0 +1,253 @@
+# load_test.py - Headless multi-session load test for the Streamlit app
+#
+# Drives simulated chat sessions through agent_app.py with Streamlit's
+# AppTest runner. research_report() is replaced by a stub that returns a
+# canned report (and streams its source events), so no API calls are made.
+#
+# Reports rerun latency against conversation length, memory held per
+# session and throughput in sessions per worker process.
+#
+# Usage: python load_test.py --workers 4 --sessions 50 --messages 40
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import threading
+import tracemalloc
+from multiprocessing import Pool
+
+# The app builds API clients at import; the stub never calls them
+os.environ.setdefault("GROQ_API_KEY", "load-test")
+os.environ.setdefault("TAVILY_API_KEY", "load-test")
+# Pre-warming would research the example topics through the stub on every worker
+os.environ["CACHE_PREWARM"] = "0"
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_app.py")
+
+# Every prompt here must route to RESEARCH - the intent tables match
+# substrings, so words containing "hi" (vehicle, ethics) route to GREETING
+RESEARCH_PROMPTS = [
+    "Research electric car battery recycling",
+    "Research AI governance",
+    "Research Tesla vs competitors",
+    "Analyze remote work productivity trends",
+    "Investigate urban vertical farming",
+]
+CHAT_PROMPTS = [
+    "Hello there",
+    "What can you do?",
+    "Tell me more about that",
+    "How do you work?",
+]
+
+STUB_SUMMARY = """## Executive Summary
+{topic} has drawn sustained attention in 2023 and 2024, with **several credible sources** agreeing on the main trends.
+
+## Key Findings
+- Adoption grew steadily across the period covered by the sources
+- Costs fell while *quality* and availability improved
+- Regulation remains uneven between regions
+
+## Advantages/Benefits
+Sources highlight efficiency gains, lower long-term costs and broader access.
+
+## Disadvantages/Criticisms/Concerns
+- Upfront investment is still high
+- Some claims rely on a `single-source` estimate and need verification
+
+## Future Outlook/Trends
+Analysts expect continued growth, with open questions around supply chains and policy.
+"""
+
+STUB_DOMAINS = ["en.wikipedia.org", "www.reuters.com", "techcrunch.com", "www.example-shop.com", "www.bbc.com", "wired.com"]
+
+def stub_research_report(query, on_event=None, profiler=None, **kwargs):
+    """Stand-in for main.research_report that returns a canned report"""
+    import main
+
+    delay = float(os.environ.get("LOAD_TEST_RESEARCH_DELAY", "0"))
+    search_queries = [f"{query} criticisms", f"{query} benefits", f"{query} overview", f"{query} vs alternatives"]
+    main.emit_event(on_event, 'queries', queries=search_queries)
+
+    controller = main.AdaptiveSearchController()
+    for search_query in search_queries:
+        if delay:
+            threading.Event().wait(delay / (len(search_queries) + 1))
+        results = [{
+            'url': f"https://{domain}/{search_query.replace(' ', '-').lower()}",
+            'title': f"{search_query.title()} - {domain}",
+            'content': f"In 2024 {query} was covered in depth. " * 10,
+        } for domain in STUB_DOMAINS[:3]]
+        for result, duplicate in controller.add_results(search_query, results):
+            main.emit_event(on_event, 'source', query=search_query, duplicate=duplicate,
+                            title=result['title'], url=result['url'],
+                            credibility=result.get('credibility'), searches=controller.searches)
+
+    unique_results = controller.sorted_results()
+    main.emit_event(on_event, 'stage', stage='fact_check', sources=len(unique_results))
+    main.emit_event(on_event, 'stage', stage='summary')
+    if delay:
+        threading.Event().wait(delay / (len(search_queries) + 1))
+    return {
+        'query': query,
+        'search_queries': search_queries,
+        'summary': STUB_SUMMARY.format(topic=query),
+        'fact_check': "CONSISTENT: stub",
+        'sources': list(main.create_source_reference_map(unique_results[:12]).values()),
+        'search_calls': controller.searches
+    }
+
+def install_stubs(skip_delays):
+    """Swap research_report for the stub before the app script imports it"""
+    import main
+    main.research_report = stub_research_report
+    if skip_delays:
+        # Typing delays in the app are plain time.sleep calls
+        time.sleep = lambda seconds: None
+
+def conversation_prompts(messages, research_every):
+    """Yield user prompts, with a research request every `research_every` turns"""
+    for turn in range(messages):
+        if turn % research_every == research_every - 1:
+            yield RESEARCH_PROMPTS[turn // research_every % len(RESEARCH_PROMPTS)]
+        else:
+            yield CHAT_PROMPTS[turn % len(CHAT_PROMPTS)]
+
+def run_session(messages, research_every, timeout):
+    """Run one simulated session and return (samples, app) where samples are latency dicts"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    app.run()
+    samples = []
+    for prompt in conversation_prompts(messages, research_every):
+        started = time.perf_counter()
+        app.chat_input[0].set_value(prompt).run()
+        # Research finishes over follow-up reruns, like the browser would trigger
+        for _ in range(5):
+            if app.session_state.messages[-1].get("research") or "I'll research" not in app.session_state.messages[-1]["content"]:
+                break
+            app.run()
+        turn_latency = time.perf_counter() - started
+        # Label by what the app did, not by the prompt, in case routing changes
+        researched = "research" in app.session_state.messages[-1]
+
+        # A plain rerun (e.g. a widget change) re-renders the whole conversation
+        started = time.perf_counter()
+        app.run()
+        rerun_latency = time.perf_counter() - started
+
+        if app.exception:
+            raise RuntimeError(f"App raised during load test: {app.exception[0].value}")
+        samples.append({
+            'conversation_length': len(app.session_state.messages),
+            'turn_latency': turn_latency,
+            'rerun_latency': rerun_latency,
+            'research': researched,
+        })
+    return samples, app
+
+def run_worker(options):
+    """Run a batch of sessions in one worker process"""
+    install_stubs(options['skip_delays'])
+    os.environ["LOAD_TEST_RESEARCH_DELAY"] = str(options['research_delay'])
+
+    # A short warm-up session loads Streamlit's lazy imports, then one
+    # session is traced to measure the memory it holds. Tracing slows it
+    # down, so neither session counts towards the latency samples.
+    run_session(1, options['research_every'], options['timeout'])
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    _, app = run_session(options['messages'], options['research_every'], options['timeout'])
+    session_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del app
+
+    samples = []
+    started = time.perf_counter()
+    for _ in range(options['sessions']):
+        session_samples, _ = run_session(options['messages'], options['research_every'], options['timeout'])
+        samples.extend(session_samples)
+    elapsed = time.perf_counter() - started
+    return {'samples': samples, 'session_bytes': session_bytes, 'sessions': options['sessions'], 'elapsed': elapsed}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def summarize(results, bucket_size):
+    """Aggregate worker results into latency buckets, memory and throughput"""
+    samples = [sample for result in results for sample in result['samples']]
+    buckets = {}
+    for sample in samples:
+        bucket = (sample['conversation_length'] - 1) // bucket_size * bucket_size + 1
+        buckets.setdefault(bucket, []).append(sample)
+
+    rows = []
+    for bucket in sorted(buckets):
+        bucket_samples = buckets[bucket]
+        reruns = [sample['rerun_latency'] * 1000 for sample in bucket_samples]
+        turns = [sample['turn_latency'] * 1000 for sample in bucket_samples]
+        rows.append({
+            'messages': f"{bucket}-{bucket + bucket_size - 1}",
+            'samples': len(bucket_samples),
+            'rerun_p50_ms': statistics.median(reruns),
+            'rerun_p95_ms': percentile(reruns, 0.95),
+            'turn_p50_ms': statistics.median(turns),
+            'turn_p95_ms': percentile(turns, 0.95),
+        })
+
+    return {
+        'latency_by_length': rows,
+        'memory_per_session_kib': statistics.mean(result['session_bytes'] for result in results) / 1024,
+        'sessions_per_second_per_worker': statistics.mean(result['sessions'] / result['elapsed'] for result in results),
+        'total_sessions': sum(result['sessions'] for result in results),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-session load test for agent_app.py")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes")
+    parser.add_argument("--sessions", type=int, default=50, help="total simulated sessions, split across workers")
+    parser.add_argument("--messages", type=int, default=40, help="user messages per session")
+    parser.add_argument("--research-every", type=int, default=4, help="every Nth user message requests research")
+    parser.add_argument("--research-delay", type=float, default=0.0, help="seconds the stubbed research takes")
+    parser.add_argument("--skip-delays", action="store_true", help="skip the app's typing delays")
+    parser.add_argument("--bucket", type=int, default=10, help="conversation length bucket size")
+    parser.add_argument("--timeout", type=float, default=120, help="per-run AppTest timeout in seconds")
+    parser.add_argument("--json", metavar="PATH", help="also write the summary as JSON")
+    args = parser.parse_args()
+
+    # Spread the sessions so the total matches --sessions exactly
+    workers = max(min(args.workers, args.sessions), 1)
+    per_worker, extra = divmod(args.sessions, workers)
+    options = [{
+        'sessions': per_worker + (1 if worker < extra else 0),
+        'messages': args.messages,
+        'research_every': args.research_every,
+        'research_delay': args.research_delay,
+        'skip_delays': args.skip_delays,
+        'timeout': args.timeout,
+    } for worker in range(workers)]
+    print(f"Running {args.sessions} sessions x {args.messages} messages on {workers} workers...")
+    started = time.perf_counter()
+    with Pool(workers) as pool:
+        results = pool.map(run_worker, options)
+    summary = summarize(results, args.bucket)
+    summary['wall_seconds'] = time.perf_counter() - started
+
+    print(f"\n{'messages':<12}{'samples':>8}{'rerun p50':>12}{'rerun p95':>12}{'turn p50':>12}{'turn p95':>12}")
+    for row in summary['latency_by_length']:
+        print(f"{row['messages']:<12}{row['samples']:>8}{row['rerun_p50_ms']:>10.1f}ms{row['rerun_p95_ms']:>10.1f}ms"
+              f"{row['turn_p50_ms']:>10.1f}ms{row['turn_p95_ms']:>10.1f}ms")
+    print(f"\nMemory per session: {summary['memory_per_session_kib']:.1f} KiB")
+    print(f"Throughput: {summary['sessions_per_second_per_worker']:.3f} sessions/s per worker process")
+    print(f"Total: {summary['total_sessions']} sessions in {summary['wall_seconds']:.1f}s")
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(summary, output, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
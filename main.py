@@ -1,60 +1,237 @@
 import os
-from groq import Groq
+import argparse
+from groq import Groq, APITimeoutError
 from tavily import TavilyClient
 from dotenv import load_dotenv
 from urllib.parse import urlparse
 import re
+import time
+import hashlib
+import contextvars
+import queue
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime
+from matcher import PhraseMatcher
+from profiling import StageProfiler, profile_stage
+from compression import compress_sources, split_sentences, sentence_key, WORD_PATTERN, MIN_SENTENCE_WORDS
+from intent import extract_research_topic
+from query_expansion import PERSPECTIVES, expand_queries, normalize_topic
 
 load_dotenv()
 
 groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 tavily = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
 
-def format_citation(title, url, domain, credibility_level, style="APA"):
-    """Format a source into proper academic citation"""
-    # Extract domain name for publisher
-    publisher = domain.replace('www.', '').replace('.com', '').replace('.org', '').replace('.edu', '').replace('.gov', '')
-    publisher = publisher.split('.')[0].title()
+CITATION_STYLES = ["APA", "MLA", "Simple"]
+CREDIBILITY_ICONS = {"High": "🟢", "Medium": "🟡", "Low": "🔴"}
+
+# High credibility domains
+HIGH_CREDIBILITY_DOMAINS = [
+    'wikipedia.org', 'britannica.com', 'reuters.com', 'bbc.com', 'npr.org',
+    'gov', 'edu', 'org', 'nytimes.com', 'wsj.com', 'theguardian.com',
+    'forbes.com', 'bloomberg.com', 'cnn.com', 'nbcnews.com', 'cbsnews.com'
+]
+
+# Medium credibility domains
+MEDIUM_CREDIBILITY_DOMAINS = [
+    'techcrunch.com', 'wired.com', 'arstechnica.com', 'engadget.com',
+    'motortrend.com', 'caranddriver.com', 'consumerreports.org',
+    'trustpilot.com', 'glassdoor.com', 'yelp.com'
+]
+
+# Low credibility indicators
+LOW_CREDIBILITY_INDICATORS = [
+    'buy', 'sale', 'shop', 'store', 'purchase', 'deal', 'discount',
+    'cheap', 'best-price', 'for-sale', 'wheels', 'parts'
+]
+
+# Official company domain suffixes
+COMPANY_DOMAIN_INDICATORS = ['.com', '.co.uk']
+
+CREDIBILITY_MATCHER = PhraseMatcher({
+    "high": HIGH_CREDIBILITY_DOMAINS,
+    "medium": MEDIUM_CREDIBILITY_DOMAINS,
+    "low": LOW_CREDIBILITY_INDICATORS,
+    "company": COMPANY_DOMAIN_INDICATORS,
+})
+
+# Comparative topics: "X vs Y", "X compared to Y", "compare X and Y"
+COMPARISON_SPLIT = re.compile(r"\s+(?:vs\.?|versus|compared (?:to|with))\s+", re.IGNORECASE)
+COMPARE_PREFIX = re.compile(r"(?:compare|comparing|comparison of|differences? between)\s+(.+)", re.IGNORECASE)
+# After "compare", "with" and "against" delimit entities too
+COMPARE_SPLIT = re.compile(r"\s+(?:vs\.?|versus|compared (?:to|with)|with|against)\s+", re.IGNORECASE)
+# "A, B and C" - "and" separates entities only in a comma list, or when it
+# is the only delimiter ("compare A and B")
+ENTITY_LIST_SPLIT = re.compile(r"\s*,\s*(?:(?:and|or)\s+)?|\s+(?:and|or)\s+", re.IGNORECASE)
+# Entities that only make sense relative to the first one ("Tesla vs
+# competitors", "iPhone 15 with its predecessor") - compared after the first
+# article is dropped
+GENERIC_RIVALS = {'competitors', 'competition', 'rivals', 'alternatives', 'others'}
+RELATIVE_REFERENCES = {'predecessor', 'predecessors', 'successor', 'successors', 'previous version',
+                       'previous model', 'previous generation', 'older version', 'older model', 'older models',
+                       'last version', 'last model', 'earlier version', 'earlier model', 'newer version', 'newer model'}
+MAX_COMPARISON_ENTITIES = 4
+# "Compare the pros and cons of X" weighs aspects of one topic - an entity
+# opening with one of these words is an aspect, not a thing to research
+ASPECT_WORDS = {'pros', 'cons', 'advantages', 'disadvantages', 'benefits', 'drawbacks', 'risks',
+                'costs', 'strengths', 'weaknesses', 'upsides', 'downsides', 'positives', 'negatives'}
+LEADING_ARTICLES = {'the', 'a', 'an', 'its', 'their'}
+
+# The first perspective is searched from the local template; LLM-refined
+# queries, generated meanwhile, replace the ones after it if they arrive
+# within REFINEMENT_GRACE seconds of that search finishing. Swapping before
+# the second search means a run that stops at the minimum of two searches
+# still uses a refined query.
+REFINE_AFTER_SEARCHES = 1
+REFINEMENT_GRACE = 1.0
+
+class TTLCache:
+    """Thread-safe key/value cache whose entries expire after ttl seconds
     
-    # Get current date for access date
-    access_date = datetime.now().strftime("%B %d, %Y")
+    Expired entries are purged whenever a value is stored, and the least
+    recently used entries are evicted beyond max_entries.
+    """
     
-    if style == "APA":
-        # APA Style: Author/Organization. (Year). Title. URL
-        citation = f"{publisher}. (2024). {title}. Retrieved {access_date}, from {url}"
-    elif style == "MLA":
-        # MLA Style: "Title." Publisher, Date, URL.
-        citation = f'"{title}." {publisher}, {access_date}, {url}.'
-    else:  # Simple format
-        citation = f"{title}. {publisher}. Retrieved {access_date}. {url}"
+    def __init__(self, ttl=3600, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            for expired in [k for k, (stored, _) in self._entries.items() if now - stored >= self.ttl]:
+                del self._entries[expired]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# Shared by every session in the process, and filled ahead of time by the pre-warmer
+search_cache = TTLCache()
+llm_cache = TTLCache()
+
+# Set in a thread (e.g. the pre-warmer) to fetch fresh results and overwrite cached ones
+cache_refresh = contextvars.ContextVar('cache_refresh', default=False)
+
+@contextmanager
+def refreshing_caches():
+    """Bypass cache reads for the duration of the block, storing fresh results"""
+    token = cache_refresh.set(True)
+    try:
+        yield
+    finally:
+        cache_refresh.reset(token)
+
+# Topics researched recently, so the pre-warmer can keep popular ones fresh
+recent_queries = deque(maxlen=200)
+
+def popular_queries(n=3):
+    """Return the n most requested research topics since startup"""
+    return [query for query, _ in Counter(recent_queries).most_common(n)]
+
+def cached_search(query, max_results, timeout=None):
+    """Search the web through the shared cache, returning copies safe to annotate
     
-    return citation
+    A cached search serves any request for the same or fewer results.
+    timeout (seconds) bounds the Tavily request when given.
+    """
+    key = " ".join(query.lower().split())
+    entry = None if cache_refresh.get() else search_cache.get(key)
+    if entry and entry['max_results'] >= max_results:
+        results = entry['results'][:max_results]
+    else:
+        options = {'timeout': timeout} if timeout is not None else {}
+        results = tavily.search(query=query, max_results=max_results, **options)['results']
+        search_cache.put(key, {'max_results': max_results, 'results': results})
+    return [dict(result) for result in results]
+
+def cached_completion(prompt, max_tokens=None, timeout=None):
+    """Run a Groq completion through the shared cache and return its text"""
+    key = hashlib.sha256(f"{max_tokens}:{prompt}".encode()).hexdigest()
+    content = None if cache_refresh.get() else llm_cache.get(key)
+    if content is None:
+        options = {}
+        if max_tokens is not None:
+            options['max_tokens'] = max_tokens
+        if timeout is not None:
+            options['timeout'] = timeout
+        # A retry after a timeout would run past the caller's deadline
+        client = groq_client.with_options(max_retries=0) if timeout is not None else groq_client
+        completion = client.chat.completions.create(
+            model="llama-3.1-8b-instant",  # production model on Groq
+            messages=[{"role": "user", "content": prompt}],
+            **options
+        )
+        content = completion.choices[0].message.content
+        llm_cache.put(key, content)
+    return content
 
 def create_source_reference_map(unique_results):
-    """Create a mapping of sources for inline citations"""
+    """Create a mapping of sources with citations precomputed in every style"""
+    # One access date for the whole batch instead of one strftime per source
+    access_date = datetime.now().strftime("%B %d, %Y")
     source_map = {}
     for i, result in enumerate(unique_results, 1):
         # Create short reference key
         domain = result['credibility']['domain']
         publisher = domain.replace('www.', '').split('.')[0].title()
         key = f"{publisher}_{i}"
+        citations = format_citations(result['title'], result['url'], domain, access_date)
         
         source_map[result['url']] = {
             'key': key,
+            'title': result['title'],
+            'url': result['url'],
+            'search_query': result.get('search_query', ''),
             'short_cite': f"({publisher}, 2024)",
-            'full_citation': format_citation(
-                result['title'], 
-                result['url'], 
-                domain,
-                result['credibility']['level']
-            ),
-            'credibility': result['credibility']['level']
+            'full_citation': citations['APA'],
+            'citations': citations,
+            'credibility': result['credibility']['level'],
+            'score': result['credibility']['score']
         }
     return source_map
 
-def analyze_fact_consistency(unique_results):
-    """Analyze consistency of facts across multiple sources"""
+def format_sources_section(search_queries, sources, style="APA"):
+    """Format source records into the sources section for a citation style"""
+    sources_by_query = {search_query: [] for search_query in search_queries}
+    for source in sources:
+        sources_by_query.setdefault(source['search_query'], []).append(source)
+    
+    sources_section = "\n\n**SOURCES BY SEARCH PERSPECTIVE:**\n"
+    for i, (search_query, query_sources) in enumerate(sources_by_query.items(), 1):
+        sources_section += f"\nSearch Perspective {i}: {search_query}\n"
+        sources_section += "\n".join(
+            f"- {CREDIBILITY_ICONS[source['credibility']]} {source['citations'].get(style, source['citations']['Simple'])}"
+            for source in query_sources
+        ) + "\n"
+    return sources_section
+
+def render_report(report, citation_style="APA"):
+    """Combine a structured research report into markdown in the given citation style"""
+    return report['summary'] + format_sources_section(report['search_queries'], report['sources'], citation_style)
+
+def analyze_fact_consistency(unique_results, timeout=None):
+    """Analyze consistency of facts across multiple sources
+    
+    With a timeout the call is not retried, and APITimeoutError is raised
+    so the caller can fall back to local_fact_check().
+    """
     fact_check_prompt = f"""
     Analyze the following sources for factual consistency and potential contradictions:
     
@@ -73,62 +250,66 @@ def analyze_fact_consistency(unique_results):
     """
     
     try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": fact_check_prompt}],
-        )
-        return completion.choices[0].message.content
+        return cached_completion(fact_check_prompt, timeout=timeout)
+    except APITimeoutError:
+        if timeout is not None:
+            raise
+        return "Fact-checking analysis unavailable: the request timed out"
     except Exception as e:
         return f"Fact-checking analysis unavailable: {e}"
-from urllib.parse import urlparse
-import re
-from datetime import datetime
 
-load_dotenv()
-
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-tavily = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+def local_fact_check(unique_results, max_claims=5):
+    """Fact-check without the LLM, by matching sentences across sources
+    
+    A sentence found in several sources counts as consistent, and a
+    sentence with figures found in only one source needs verification.
+    Contradictions cannot be detected this way. Uses the same output
+    format as analyze_fact_consistency.
+    """
+    sources_by_key = {}
+    sentences = {}
+    for index, result in enumerate(unique_results):
+        for sentence in split_sentences(result['content']):
+            words = WORD_PATTERN.findall(sentence.lower())
+            if len(words) < MIN_SENTENCE_WORDS:
+                continue
+            key = sentence_key(words)
+            sources_by_key.setdefault(key, set()).add(index)
+            sentences.setdefault(key, sentence)
+    
+    consistent = [(len(sources), sentences[key]) for key, sources in sources_by_key.items() if len(sources) > 1]
+    consistent.sort(key=lambda claim: claim[0], reverse=True)
+    single = [sentences[key] for key, sources in sources_by_key.items()
+              if len(sources) == 1 and any(char.isdigit() for char in sentences[key])]
+    
+    lines = [f"CONSISTENT: {sentence} (appears in {count} sources)" for count, sentence in consistent[:max_claims]]
+    lines += [f"SINGLE-SOURCE: {sentence}" for sentence in single[:max_claims]]
+    lines.append("CONTRADICTORY: not checked (quick local fact-check)")
+    return "\n".join(lines)
 
 def analyze_source_credibility(url, title, content):
     """Analyze the credibility of a source based on URL, title, and content"""
     domain = urlparse(url).netloc.lower()
     
-    # High credibility domains
-    high_credibility = [
-        'wikipedia.org', 'britannica.com', 'reuters.com', 'bbc.com', 'npr.org',
-        'gov', 'edu', 'org', 'nytimes.com', 'wsj.com', 'theguardian.com',
-        'forbes.com', 'bloomberg.com', 'cnn.com', 'nbcnews.com', 'cbsnews.com'
-    ]
-    
-    # Medium credibility domains
-    medium_credibility = [
-        'techcrunch.com', 'wired.com', 'arstechnica.com', 'engadget.com',
-        'motortrend.com', 'caranddriver.com', 'consumerreports.org',
-        'trustpilot.com', 'glassdoor.com', 'yelp.com'
-    ]
-    
-    # Low credibility indicators
-    low_credibility_indicators = [
-        'buy', 'sale', 'shop', 'store', 'purchase', 'deal', 'discount',
-        'cheap', 'best-price', 'for-sale', 'wheels', 'parts'
-    ]
+    # One scan of the domain finds every table with a matching entry
+    domain_labels = CREDIBILITY_MATCHER.labels(domain)
     
     credibility_score = 50  # Start with neutral
     credibility_level = "Medium"
     
     # Domain analysis
-    if any(hc in domain for hc in high_credibility):
+    if "high" in domain_labels:
         credibility_score += 30
         credibility_level = "High"
-    elif any(mc in domain for mc in medium_credibility):
+    elif "medium" in domain_labels:
         credibility_score += 15
         credibility_level = "Medium"
-    elif any(lc in domain.lower() or lc in url.lower() for lc in low_credibility_indicators):
+    elif "low" in domain_labels or "low" in CREDIBILITY_MATCHER.labels(url.lower()):
         credibility_score -= 25
         credibility_level = "Low"
     
     # Official company domains get higher credibility
-    if any(indicator in domain for indicator in ['.com', '.co.uk']) and not any(lc in domain for lc in low_credibility_indicators):
+    if "company" in domain_labels and "low" not in domain_labels:
         if 'official' in title.lower() or 'company' in title.lower():
             credibility_score += 10
     
@@ -152,117 +333,194 @@ def analyze_source_credibility(url, title, content):
         'domain': domain
     }
 
-def format_citation(title, url, domain, credibility_level, style="APA"):
-    """Format a source into proper academic citation"""
+def format_citations(title, url, domain, access_date):
+    """Format a source into every supported citation style at once"""
     # Extract domain name for publisher
     publisher = domain.replace('www.', '').replace('.com', '').replace('.org', '').replace('.edu', '').replace('.gov', '')
     publisher = publisher.split('.')[0].title()
     
-    # Get current date for access date
-    access_date = datetime.now().strftime("%B %d, %Y")
-    
-    if style == "APA":
+    return {
         # APA Style: Author/Organization. (Year). Title. Publisher. URL
-        citation = f"{publisher}. (2024). {title}. Retrieved {access_date}, from {url}"
-    elif style == "MLA":
+        "APA": f"{publisher}. (2024). {title}. Retrieved {access_date}, from {url}",
         # MLA Style: "Title." Publisher, Date, URL.
-        citation = f'"{title}." {publisher}, {access_date}, {url}.'
-    else:  # Simple format
-        citation = f"{title}. {publisher}. Retrieved {access_date}. {url}"
+        "MLA": f'"{title}." {publisher}, {access_date}, {url}.',
+        # Simple format
+        "Simple": f"{title}. {publisher}. Retrieved {access_date}. {url}",
+    }
+
+class AdaptiveSearchController:
+    """Decide how many searches to run from the credibility of results so far
+    
+    Results are deduplicated and scored as each search returns. Targets are
+    cumulative - {"High": 4, "Medium": 6} means at least 4 High sources and
+    at least 6 sources at Medium or better. Searching stops once every target
+    is met, and the per-query result count is raised while results come
+    back thin.
+    """
+    
+    def __init__(self, targets=None, base_results=3, max_results_cap=7, min_searches=2, max_searches=6):
+        self.targets = targets or {"High": 4, "Medium": 6}
+        self.base_results = base_results
+        self.max_results_cap = max_results_cap
+        self.min_searches = min_searches
+        self.max_searches = max_searches
+        self.max_results = base_results
+        self.searches = 0
+        self.answered_queries = set()
+        self.seen_urls = set()
+        self.unique_results = []
+        self.counts = {"High": 0, "Medium": 0, "Low": 0}
+    
+    def add_results(self, search_query, results):
+        """Deduplicate and score one batch, returning (result, is_duplicate) pairs"""
+        self.searches += 1
+        self.answered_queries.add(search_query)
+        outcomes = []
+        useful = 0
+        for result in results:
+            if result['url'] in self.seen_urls:
+                outcomes.append((result, True))
+                continue
+            self.seen_urls.add(result['url'])
+            result['search_query'] = search_query
+            # Add credibility analysis
+            result['credibility'] = analyze_source_credibility(result['url'], result['title'], result['content'])
+            self.counts[result['credibility']['level']] += 1
+            self.unique_results.append(result)
+            outcomes.append((result, False))
+            if result['credibility']['level'] != "Low":
+                useful += 1
+        
+        # Ask for more per query when fewer than half the results were new and credible
+        if useful * 2 < self.max_results:
+            self.max_results = min(self.max_results + 2, self.max_results_cap)
+        return outcomes
+    
+    def satisfied(self):
+        """True once every target is met, counting better sources towards lower levels"""
+        at_least = {}
+        total = 0
+        for level in ("High", "Medium", "Low"):
+            total += self.counts[level]
+            at_least[level] = total
+        return all(at_least[level] >= target for level, target in self.targets.items())
+    
+    def should_continue(self, pending_queries):
+        """Decide whether to issue another search"""
+        if self.searches >= self.max_searches:
+            return False
+        if self.searches < self.min_searches:
+            return bool(pending_queries)
+        return bool(pending_queries) and not self.satisfied()
+    
+    def retry_query(self, search_queries):
+        """Pick a perspective to search again with more results, or None"""
+        if self.satisfied() or self.searches >= self.max_searches or self.max_results == self.base_results:
+            return None
+        # Re-run the perspective that produced the most High credibility sources
+        high_by_query = {search_query: 0 for search_query in search_queries}
+        for result in self.unique_results:
+            if result['credibility']['level'] == "High" and result['search_query'] in high_by_query:
+                high_by_query[result['search_query']] += 1
+        return max(high_by_query, key=high_by_query.get) if high_by_query else None
+    
+    def sorted_results(self):
+        """Unique results sorted by credibility score (highest first)"""
+        return sorted(self.unique_results, key=lambda x: x['credibility']['score'], reverse=True)
+
+# Typical seconds per stage, used to plan a run that has a deadline
+STAGE_SECONDS = {
+    'query_generation': 1.5,
+    'search': 1.5,
+    'fact_check': 3.0,
+    'summary': 6.0,
+    'short_summary': 3.0,
+}
+SHORT_SUMMARY_TOKENS = 600
+SHORT_SUMMARY_SOURCES = 6
+
+class LatencyBudget:
+    """Track the time left before a research deadline and the stages cut to meet it
+    
+    With seconds=None there is no deadline and every stage is allowed.
+    """
+    
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.degraded = []
+    
+    def remaining(self):
+        """Seconds left before the deadline (infinite without one)"""
+        return self.deadline - time.monotonic() if self.deadline is not None else float('inf')
+    
+    def allows(self, *stages):
+        """True if the typical time of the given stages fits in what is left"""
+        return self.remaining() >= sum(STAGE_SECONDS[stage] for stage in stages)
     
-    return citation
+    def timeout(self, *reserved_stages, minimum=1.0):
+        """Seconds a call may take while leaving time for the given later stages
+        
+        None without a deadline, so clients keep their default timeouts.
+        """
+        if self.deadline is None:
+            return None
+        return max(self.remaining() - sum(STAGE_SECONDS[stage] for stage in reserved_stages), minimum)
+    
+    def degrade(self, stage, detail):
+        """Record that a stage was skipped or shortened"""
+        entry = {'stage': stage, 'detail': detail}
+        if entry not in self.degraded:
+            self.degraded.append(entry)
+            print(f"Latency budget: {stage} - {detail} ({self.remaining():.1f}s left)")
 
 def generate_search_queries(original_query: str):
     """Generate multiple related search queries for comprehensive research"""
     prompt = f"""
     Generate 4 related search queries for comprehensive research on: "{original_query}"
     
-    Include:
-    1. An informational query about the brand/topic (add "brand overview history" or "company information" to avoid commercial results)
-    2. A query about problems/criticisms/disadvantages/issues
-    3. A query about benefits/advantages/features/positive aspects
+    Include, in this order:
+    1. A query about problems/criticisms/disadvantages/issues
+    2. A query about benefits/advantages/features/positive aspects
+    3. An informational query about the brand/topic (add "brand overview history" or "company information" to avoid commercial results)
     4. A comparative query (vs competitors or alternatives)
     
-    Make sure the first query focuses on getting informational content, not commercial/sales pages.
+    Make sure the third query focuses on getting informational content, not commercial/sales pages.
     
     Return only the queries, one per line, no numbering or formatting.
     """
     
-    completion = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[{"role": "user", "content": prompt}],
-    )
+    content = cached_completion(prompt)
     
-    queries = [q.strip() for q in completion.choices[0].message.content.strip().split('\n') if q.strip()]
+    queries = [q.strip() for q in content.strip().split('\n') if q.strip()]
     return queries[:4]  # Ensure max 4 queries
 
-def research(query: str, citation_style="APA"):
-    # Step 1: Generate multiple search queries
-    search_queries = generate_search_queries(query)
-    print(f"Searching with queries: {search_queries}")
-    
-    # Step 2: Search web with multiple queries
-    all_results = []
-    for search_query in search_queries:
-        try:
-            results = tavily.search(query=search_query, max_results=3)  # Reduced per query to manage total
-            all_results.extend(results['results'])
-        except Exception as e:
-            print(f"Search failed for query '{search_query}': {e}")
-            continue
-    
-    # Remove duplicates based on URL and analyze credibility
-    seen_urls = set()
-    unique_results = []
-    for result in all_results:
-        if result['url'] not in seen_urls:
-            seen_urls.add(result['url'])
-            # Add credibility analysis
-            credibility = analyze_source_credibility(result['url'], result['title'], result['content'])
-            result['credibility'] = credibility
-            unique_results.append(result)
-    
-    # Sort by credibility score (highest first)
-    unique_results.sort(key=lambda x: x['credibility']['score'], reverse=True)
-    
-    # Step 3: Perform fact-checking analysis
-    fact_check_analysis = analyze_fact_consistency(unique_results)
-    
-    # Create source reference map for inline citations
-    source_map = create_source_reference_map(unique_results)
+# Report sections, each with the search perspective it needs (None for any)
+SUMMARY_SECTIONS = [
+    ("Executive Summary (2-3 sentences)", None),
+    ("Key Findings (main facts and insights - prioritize CONSISTENT facts from High credibility sources)", None),
+    ("Advantages/Benefits", "benefits"),
+    ("Disadvantages/Criticisms/Concerns", "criticisms"),
+    ("Different Perspectives (if applicable)", None),
+    ("Market Position/Comparisons (if applicable)", "comparison"),
+    ("Future Outlook/Trends", None),
+    ("Fact-Check Alerts (highlight any contradictory or single-source claims that need verification)", None),
+    ("Open Questions/Areas for Further Research", None),
+]
+
+def build_summary_prompt(query, search_queries, unique_results, fact_check_analysis, entities=None, max_sources=12, brief=False, perspectives=None):
+    """Build the summarization prompt from the ranked sources and fact-check analysis
     
-    # Step 4: Format results for analysis with credibility indicators
-    snippets = "\n".join([f"- {r['title']} [Credibility: {r['credibility']['level']}]: {r['url']}\n  {r['content']}" for r in unique_results[:12]])  # Limit total results
-    
-    # Step 4: Organize sources by search query for better citation with credibility
-    sources_by_query = {}
-    result_index = 0
-    for i, search_query in enumerate(search_queries):
-        sources_by_query[search_query] = []
-        # Get results for this specific query (approximate based on order)
-        query_results = unique_results[result_index:result_index+3]
-        for result in query_results:
-            credibility_icon = {"High": "🟢", "Medium": "🟡", "Low": "🔴"}[result['credibility']['level']]
-            # Create proper citation
-            citation = format_citation(
-                result['title'], 
-                result['url'], 
-                result['credibility']['domain'],
-                result['credibility']['level'],
-                citation_style
-            )
-            sources_by_query[search_query].append(
-                f"- {credibility_icon} {citation}"
-            )
-        result_index += len(query_results)
-    
-    # Format sources section
-    sources_section = "\n\n**SOURCES BY SEARCH PERSPECTIVE:**\n"
-    for i, (search_query, sources) in enumerate(sources_by_query.items(), 1):
-        sources_section += f"\nSearch Perspective {i}: {search_query}\n"
-        sources_section += "\n".join(sources) + "\n"
+    perspectives is the set of perspectives that were searched. Sections
+    that need a perspective missing from it are left out, so the report
+    does not argue one side from no sources. None keeps every section.
+    """
+    # Format results for analysis with credibility indicators
+    snippets = "\n".join([f"- {r['title']} [Credibility: {r['credibility']['level']}]: {r['url']}\n  {r['content']}" for r in unique_results[:max_sources]])  # Limit total results
+    sections = [section for section, needs in SUMMARY_SECTIONS
+                if needs is None or perspectives is None or needs in perspectives]
+    sections = "\n    ".join(f"- {section}" for section in sections)
 
-    # Step 5: Enhanced summarization with Groq
     prompt = f"""
     You are an expert research assistant conducting comprehensive analysis with fact-checking capabilities.
     Task: Create a detailed, balanced research report from multiple search perspectives.
@@ -277,15 +535,7 @@ def research(query: str, citation_style="APA"):
     {fact_check_analysis}
 
     Create a comprehensive report with:
-    - Executive Summary (2-3 sentences)
-    - Key Findings (main facts and insights - prioritize CONSISTENT facts from High credibility sources)
-    - Advantages/Benefits
-    - Disadvantages/Criticisms/Concerns
-    - Different Perspectives (if applicable)
-    - Market Position/Comparisons (if applicable)
-    - Future Outlook/Trends
-    - Fact-Check Alerts (highlight any contradictory or single-source claims that need verification)
-    - Open Questions/Areas for Further Research
+    {sections}
 
     IMPORTANT INSTRUCTIONS:
     1. Prioritize information that appears in multiple sources (marked as CONSISTENT in fact-check analysis)
@@ -295,21 +545,398 @@ def research(query: str, citation_style="APA"):
     5. Do NOT include a sources section - I will add properly formatted sources afterward
     6. Do NOT use inline URLs or "Credit:" citations - reference sources by publisher name only when needed
     """
+    if entities:
+        covered = ["Key Findings"] + [name for name, needs in (("Advantages", "benefits"), ("Disadvantages", "criticisms"))
+                                      if perspectives is None or needs in perspectives]
+        covered = ", ".join(covered[:-1]) + " and " + covered[-1] if len(covered) > 1 else covered[0]
+        prompt += f"""
+    COMPARISON FOCUS:
+    This is a comparison of: {', '.join(entities)}
+    - Cover each of them in {covered}
+    - Add a "Side-by-Side Comparison" section with a markdown table comparing them on the main dimensions
+    - Do not favour one of them without evidence from the sources
+    """
+    if brief:
+        prompt += """
+    LENGTH LIMIT:
+    The reader needs this quickly. Keep the whole report under 300 words and
+    only include the Executive Summary, Key Findings and Fact-Check Alerts.
+    """
+    return prompt
 
-    completion = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",  # production model on Groq
-        messages=[{"role": "user", "content": prompt}],
-    )
+def extractive_summary(query, unique_results, fact_check_analysis, max_findings=8):
+    """Build a report straight from the source sentences, for when the LLM is out of time"""
+    findings = []
+    for result in unique_results:
+        sentences = split_sentences(result['content'])
+        if sentences:
+            findings.append(f"- {sentences[0]} ({result['title']})")
+        if len(findings) == max_findings:
+            break
+    topic = extract_research_topic(query).strip().rstrip('?.!')
+    return (f"## Executive Summary\nQuick summary of the most credible sources on {topic}, "
+            f"taken directly from the sources.\n\n## Key Findings\n" + "\n".join(findings) +
+            f"\n\n## Fact-Check Alerts\n{fact_check_analysis}\n")
 
+def gather_sources(search_queries, on_event=None, profiler=None, budget=None, refinement=None):
+    """Run the adaptive search over the given perspectives
+    
+    Returns (perspectives searched, controller). With a LatencyBudget,
+    searching stops early when another search would leave too little time
+    for a short summary.
+    
+    refinement is an optional future of LLM-refined queries. Once
+    REFINE_AFTER_SEARCHES perspectives are searched it is given up to
+    REFINEMENT_GRACE seconds, and replaces the perspectives not searched
+    yet. Swapping at a fixed point keeps the queries, and so the caches,
+    the same from one run to the next whenever the refinement is on time.
+    """
+    controller = AdaptiveSearchController()
+    search_queries = list(search_queries)
+    pending_queries = list(search_queries)
+    searched = []
+    attempts = 0
+    retried = False
+    while True:
+        if controller.should_continue(pending_queries):
+            issued = len(search_queries) - len(pending_queries)
+            if refinement is not None and issued >= REFINE_AFTER_SEARCHES:
+                refined = await_refinement(refinement, budget)
+                refinement = None
+                if refined:
+                    search_queries[issued:] = [refined[i] if i < len(refined) else search_queries[i]
+                                               for i in range(issued, len(search_queries))]
+                    pending_queries = search_queries[issued:]
+                    print(f"Refined remaining queries: {pending_queries}")
+            search_query = pending_queries.pop(0)
+        else:
+            # Thin results after every perspective - search the best one again, once
+            search_query = None if retried else controller.retry_query(search_queries)
+            retried = True
+            if search_query is None:
+                break
+        # Failed searches count too, so a slow search API cannot eat the whole budget
+        if budget is not None and attempts and not budget.allows('search', 'short_summary'):
+            budget.degrade('search', f"stopped after {attempts} search{'es' if attempts > 1 else ''}")
+            break
+        attempts += 1
+        if search_query not in searched:
+            searched.append(search_query)
+        try:
+            with profile_stage(profiler, 'search'):
+                timeout = budget.timeout('short_summary') if budget is not None else None
+                results = cached_search(search_query, controller.max_results, timeout)
+            with profile_stage(profiler, 'dedup_credibility'):
+                outcomes = controller.add_results(search_query, results)
+        except Exception as e:
+            print(f"Search failed for query '{search_query}': {e}")
+            continue
+        # Outside the try, so a failing progress callback is not mistaken for a failed search
+        for result, duplicate in outcomes:
+            emit_event(on_event, 'source', query=search_query, duplicate=duplicate,
+                       title=result['title'], url=result['url'],
+                       credibility=result.get('credibility'), searches=controller.searches)
+    print(f"Adaptive search used {controller.searches} searches, sources by credibility: {controller.counts}")
+    # Perspectives skipped by an early stop are left out of the report and prompt
+    return searched, controller
+
+def searched_perspectives(searched, controller):
+    """Return the perspectives whose search came back
+    
+    gather_sources searches the perspectives in order and lists each query
+    once, so the position of a query in searched is its perspective.
+    """
+    return {perspective for perspective, search_query in zip(PERSPECTIVES, searched)
+            if search_query in controller.answered_queries}
+
+def await_refinement(refinement, budget=None):
+    """Wait briefly for the LLM-refined queries, or return None to keep the templates"""
+    timeout = REFINEMENT_GRACE
+    if budget is not None and budget.deadline is not None:
+        timeout = min(timeout, budget.timeout('short_summary', minimum=0))
+    try:
+        return refinement.result(timeout=timeout)
+    except FutureTimeoutError:
+        # Searching goes on without it; the refined queries still land in the cache
+        if budget is not None and budget.deadline is not None:
+            budget.degrade('query_generation', "LLM refinement too slow, kept the template queries")
+        else:
+            print("Query refinement too slow, keeping the template queries")
+    except Exception as e:
+        print(f"Query refinement failed, keeping the template queries: {e}")
+    return None
+
+def split_entity_list(text):
+    """Split "A, B and C" into its entities; text without a comma is one entity"""
+    return ENTITY_LIST_SPLIT.split(text) if ',' in text else [text]
+
+def detect_comparison_entities(query):
+    """Return the entities of an "X vs Y" or "compare X and Y" topic, or None
+    
+    Entities are split on "vs", "versus" and "compared to" (plus "with"
+    after "compare"), then each side on a comma list. So "Procter and
+    Gamble vs Unilever" keeps its name, while "Tesla vs Ford, GM and Toyota"
+    names four entities. Only "compare A and B" splits on a lone "and".
+    Callers research more than MAX_COMPARISON_ENTITIES as one topic.
+    """
+    topic = extract_research_topic(query).strip().rstrip('?.!')
+    compare = COMPARE_PREFIX.match(topic)
+    parts = COMPARE_SPLIT.split(compare.group(1)) if compare else COMPARISON_SPLIT.split(topic)
+    if len(parts) >= 2:
+        parts = [entity for part in parts for entity in split_entity_list(part)]
+    elif compare:
+        parts = ENTITY_LIST_SPLIT.split(compare.group(1))
+    else:
+        return None
+    
+    entities = []
+    for part in parts:
+        entity = part.strip()
+        if not entity:
+            continue
+        words = entity.split()
+        if words[0].lower() in LEADING_ARTICLES:
+            words = words[1:]
+        if not words or words[0].lower() in ASPECT_WORDS:
+            return None
+        # "Tesla vs competitors" researches Tesla and Tesla's competitors
+        relative = " ".join(words).lower()
+        if relative in GENERIC_RIVALS or relative in RELATIVE_REFERENCES:
+            if not entities:
+                return None
+            entity = f"{entities[0]} {' '.join(words)}"
+        if entity.lower() not in (known.lower() for known in entities):
+            entities.append(entity)
+    return entities if len(entities) >= 2 else None
+
+def research_entities(entities, on_event=None, budget=None, refine=True):
+    """Research each entity concurrently with a shared search cache
+    
+    Returns (search queries, merged results, search calls, perspectives
+    searched for any entity). Events from the
+    worker threads are relayed to on_event from the calling thread, since
+    UI callbacks are usually not thread-safe.
+    """
+    events = queue.Queue()
+    
+    def sub_research(entity):
+        search_queries, refinement = plan_search_queries(entity, budget, refine)
+        events.put((entity, {'type': 'queries', 'queries': search_queries}))
+        return gather_sources(search_queries, lambda event: events.put((entity, event)), budget=budget, refinement=refinement)
+    
+    queries_by_entity = {}
+    searches_by_entity = {}
+    with ThreadPoolExecutor(max_workers=len(entities)) as pool:
+        # Each worker runs in a copy of this context, so cache refresh mode carries over
+        futures = [pool.submit(contextvars.copy_context().run, sub_research, entity) for entity in entities]
+        while not all(future.done() for future in futures) or not events.empty():
+            try:
+                entity, event = events.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if event['type'] == 'queries':
+                queries_by_entity[entity] = event['queries']
+                emit_event(on_event, 'queries', queries=[q for qs in queries_by_entity.values() for q in qs])
+            else:
+                searches_by_entity[entity] = event['searches']
+                if on_event is not None:
+                    on_event({**event, 'searches': sum(searches_by_entity.values()), 'entity': entity})
+        outcomes = [future.result() for future in futures]
+    
+    # Keep the best sources of every entity so each side gets coverage.
+    # Dedup happens here in entity order, not across the running threads,
+    # so the merged sources and the prompts built from them are repeatable.
+    per_entity = max(12 // len(entities), 3)
+    merged = {}
+    for _, controller in outcomes:
+        for result in controller.sorted_results()[:per_entity]:
+            merged.setdefault(result['url'], result)
+    search_queries = [search_query for entity_queries, _ in outcomes for search_query in entity_queries]
+    unique_results = sorted(merged.values(), key=lambda x: x['credibility']['score'], reverse=True)
+    perspectives = set().union(*(searched_perspectives(entity_queries, controller) for entity_queries, controller in outcomes))
+    return search_queries, unique_results, sum(controller.searches for _, controller in outcomes), perspectives
+
+def plan_search_queries(query, budget=None, refine=True):
+    """Expand the topic into perspective queries and start refining them with the LLM
+    
+    Returns (template queries, future of refined queries or None). The
+    refinement runs on its own thread while the first searches go out.
+    """
+    search_queries = expand_queries(query)
+    if not refine:
+        return search_queries, None
+    if budget is not None and not budget.allows('query_generation', 'short_summary'):
+        budget.degrade('query_generation', "skipped LLM refinement, used the template queries")
+        return search_queries, None
+    topic = normalize_topic(query)
+    # A thread of its own, so the refinement never queues behind other sessions' calls
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-refinement")
+    refinement = executor.submit(contextvars.copy_context().run, generate_search_queries, topic)
+    executor.shutdown(wait=False)
+    return search_queries, refinement
+
+def emit_event(on_event, event_type, **data):
+    """Send a progress event to the caller's callback, if one was given"""
+    if on_event is not None:
+        on_event({'type': event_type, **data})
+
+def research_report(query: str, on_event=None, profiler=None, decompose=True, record=True, deadline=None, refine=True):
+    """Run the research pipeline and return a structured report
+    
+    The returned dict holds the summary text, the search queries used and
+    the source records with citations in every style, so the sources
+    section can be re-rendered in another style without researching again.
+    
+    If on_event is given it is called with a dict for every progress event:
+    "queries" once the perspectives are known, "source" for every search
+    result (with its credibility and whether it was a duplicate), and
+    "stage" when fact-checking and summarization start.
+    
+    If profiler is a StageProfiler, each stage is recorded under its name.
+    
+    Comparative topics ("X vs Y", "compare X and Y") are split into one
+    sub-research per entity, run concurrently and merged into a single
+    comparison report. Pass decompose=False to research them as one topic,
+    as happens anyway above MAX_COMPARISON_ENTITIES entities.
+    The per-entity searches run on worker threads and are not profiled.
+    
+    Searches and LLM calls go through the shared caches. The query counts
+    towards popular_queries() unless record=False.
+    
+    Search queries come from local templates, so searching starts at once.
+    The LLM refines them in the background and its queries replace the
+    later perspectives; pass refine=False to search the templates only.
+    
+    deadline is a latency budget in seconds. When time runs short the
+    pipeline skips the LLM refinement of queries, stops searching early,
+    fact-checks locally and writes a shorter summary from fewer sources,
+    falling back to an extractive summary if the LLM times out. Every
+    such change is listed in the report's 'degraded' list.
+    """
+    if record:
+        recent_queries.append(query)
+    budget = LatencyBudget(deadline)
+    entities = detect_comparison_entities(query) if decompose else None
+    if entities and len(entities) > MAX_COMPARISON_ENTITIES:
+        # Too many for a sub-research each - search them as one topic, but
+        # keep every entity in the comparison rather than dropping some
+        print(f"Comparing {entities} as one topic, more than {MAX_COMPARISON_ENTITIES} entities")
+        decompose = False
+    if entities and decompose:
+        # Comparative topic - research each entity concurrently and merge
+        print(f"Comparing {entities} with parallel sub-research")
+        search_queries, unique_results, search_calls, perspectives = research_entities(entities, on_event, budget, refine)
+    else:
+        # Step 1: Expand the topic into perspective queries locally
+        with profile_stage(profiler, 'query_generation'):
+            search_queries, refinement = plan_search_queries(query, budget, refine)
+        print(f"Searching with queries: {search_queries}")
+        emit_event(on_event, 'queries', queries=search_queries)
+        
+        # Step 2: Search adaptively until enough credible sources are in,
+        # swapping in the LLM-refined queries once they are ready
+        search_queries, controller = gather_sources(search_queries, on_event, profiler, budget, refinement)
+        unique_results = controller.sorted_results()
+        search_calls = controller.searches
+        perspectives = searched_perspectives(search_queries, controller)
+    
+    # Strip boilerplate and repeated sentences for the summary prompt. The
+    # fact-check keeps the raw content, since claims repeated across sources
+    # are exactly what it counts as consistent.
+    raw_results = unique_results
+    with profile_stage(profiler, 'compression'):
+        unique_results, compression_stats = compress_sources(unique_results)
+    print(f"Compressed source content to {compression_stats['ratio']:.0%} "
+          f"(~{compression_stats['tokens_saved']} tokens saved)")
+    
+    # Step 3: Perform fact-checking analysis
+    emit_event(on_event, 'stage', stage='fact_check', sources=len(unique_results))
+    with profile_stage(profiler, 'fact_check'):
+        fact_check_analysis = None
+        if budget.allows('fact_check', 'summary'):
+            try:
+                fact_check_analysis = analyze_fact_consistency(raw_results, timeout=budget.timeout('summary'))
+            except APITimeoutError:
+                budget.degrade('fact_check', "LLM timed out, checked locally by matching sentences across sources")
+        else:
+            budget.degrade('fact_check', "checked locally by matching sentences across sources")
+        if fact_check_analysis is None:
+            fact_check_analysis = local_fact_check(raw_results)
+    
+    # Create source records with citations in every style for the sources section
+    with profile_stage(profiler, 'citations'):
+        source_map = create_source_reference_map(unique_results[:12])
+    
+    # Step 4: Format results for analysis with credibility indicators
+    brief = not budget.allows('summary')
+    if brief:
+        budget.degrade('summary', f"short summary from the top {SHORT_SUMMARY_SOURCES} sources")
+    with profile_stage(profiler, 'prompt'):
+        prompt = build_summary_prompt(query, search_queries, unique_results, fact_check_analysis, entities,
+                                      max_sources=SHORT_SUMMARY_SOURCES if brief else 12, brief=brief,
+                                      perspectives=perspectives)
+
+    # Step 5: Enhanced summarization with Groq
+    emit_event(on_event, 'stage', stage='summary')
+    with profile_stage(profiler, 'summary'):
+        if budget.deadline is None:
+            summary = cached_completion(prompt)
+        else:
+            try:
+                summary = cached_completion(prompt, max_tokens=SHORT_SUMMARY_TOKENS if brief else None,
+                                            timeout=budget.timeout())
+            except APITimeoutError:
+                budget.degrade('summary', "LLM timed out, summarized directly from the sources")
+                summary = extractive_summary(query, unique_results, fact_check_analysis)
+
+    return {
+        'query': query,
+        'search_queries': search_queries,
+        'summary': summary,
+        'fact_check': fact_check_analysis,
+        'sources': list(source_map.values()),
+        'search_calls': search_calls,
+        'entities': entities or [],
+        'compression': compression_stats,
+        'degraded': budget.degraded
+    }
+
+def research(query: str, citation_style="APA", deadline=None):
+    """Run the research pipeline and return the report markdown in one citation style"""
     # Combine the AI report with properly formatted sources
-    report = completion.choices[0].message.content + sources_section
-    return report
+    return render_report(research_report(query, deadline=deadline), citation_style)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI Research Agent command line")
+    parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR",
+                        help="profile each pipeline stage and write cProfile/tracemalloc output to DIR (default: profiles)")
+    parser.add_argument("--no-refine", action="store_true",
+                        help="search the template queries only, without LLM refinement")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="latency budget - skip or shorten stages to finish within SECONDS")
+    args = parser.parse_args()
+    
     user_query = input("Enter a research topic: ")
     print("Citation style options: APA, MLA, Simple")
     citation_style = input("Choose citation style (press Enter for APA): ").strip() or "APA"
     
-    report = research(user_query, citation_style)
+    profiler = StageProfiler(args.profile) if args.profile else None
+    structured_report = research_report(user_query, profiler=profiler, deadline=args.deadline, refine=not args.no_refine)
+    with profile_stage(profiler, 'citations'):
+        report = render_report(structured_report, citation_style)
     print(f"\n=== Research Report ({citation_style} Citations) ===\n")
     print(report)
+    for step in structured_report['degraded']:
+        print(f"Degraded to meet the deadline - {step['stage']}: {step['detail']}")
+    
+    if profiler:
+        # Profile the PDF export as well, since the app builds one per report
+        from report_document import generate_pdf_report
+        with profile_stage(profiler, 'pdf'):
+            pdf_buffer = generate_pdf_report(report, user_query, user_query)
+        paths = profiler.write()
+        with open(os.path.join(args.profile, "report.pdf"), "wb") as pdf_file:
+            pdf_file.write(pdf_buffer.getvalue())
+        print(f"\n=== Profile ===\n")
+        print(profiler.summary())
+        print(f"\nWrote {len(paths)} profile files to {args.profile}")
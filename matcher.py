@@ -0,0 +1,76 @@
+# matcher.py - Compiled multi-pattern phrase matcher
+from collections import deque
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over labelled phrase tables
+
+    Built once from a mapping of label -> phrases. Every lookup scans the
+    input a single time, however many phrases the tables hold.
+    """
+
+    def __init__(self, tables):
+        self.phrases = []  # pattern id -> (phrase, label), in table order
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for label, phrases in tables.items():
+            for phrase in phrases:
+                self._add(phrase, label)
+        self._build_failure_links()
+        self.max_length = max((len(phrase) for phrase, _ in self.phrases), default=0)
+
+    def _add(self, phrase, label):
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(len(self.phrases))
+        self.phrases.append((phrase, label))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                # Inherit matches that end at the fallback state
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def finditer(self, text):
+        """Yield (start, pattern_id) for every phrase occurrence in text"""
+        goto, fail, output, phrases = self._goto, self._fail, self._output, self.phrases
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in output[state]:
+                yield index - len(phrases[pattern_id][0]) + 1, pattern_id
+
+    def labels(self, text):
+        """Return the set of labels with at least one phrase found in text"""
+        return {self.phrases[pattern_id][1] for _, pattern_id in self.finditer(text)}
+
+    def word_matches(self, text):
+        """Yield (start, end, label) for phrases that start and end on word boundaries"""
+        for start, pattern_id in self.finditer(text):
+            phrase, label = self.phrases[pattern_id]
+            end = start + len(phrase)
+            if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                yield start, end, label
+
+    def match_prefix(self, text):
+        """Return the first phrase in table order that text starts with, or None"""
+        matches = [pattern_id for start, pattern_id in self.finditer(text[:self.max_length]) if start == 0]
+        return self.phrases[min(matches)][0] if matches else None
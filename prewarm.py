@@ -0,0 +1,51 @@
+# prewarm.py - Keep the search and LLM caches warm for likely topics
+import threading
+import main
+
+# The topics offered as examples in the app
+EXAMPLE_RESEARCH_QUERIES = [
+    "Research Tesla vs competitors",
+    "Tell me about AI ethics",
+]
+
+class CachePrewarmer(threading.Thread):
+    """Background thread that researches example and popular topics ahead of users
+
+    The first pass fills the shared caches for the example topics. Later
+    passes, every `interval` seconds, also cover the `top_n` most requested
+    topics and run in refresh mode, so their entries are replaced before
+    they expire and a user asking for them never waits on the APIs.
+    """
+
+    def __init__(self, topics=EXAMPLE_RESEARCH_QUERIES, top_n=3, interval=1800):
+        super().__init__(name="cache-prewarmer", daemon=True)
+        self.topics = list(topics)
+        self.top_n = top_n
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def topics_to_warm(self):
+        topics = list(self.topics)
+        for query in main.popular_queries(self.top_n):
+            if query not in topics:
+                topics.append(query)
+        return topics
+
+    def warm(self, topics):
+        for topic in topics:
+            if self.stopped.is_set():
+                return
+            try:
+                main.research_report(topic, record=False)
+            except Exception as e:
+                print(f"Cache pre-warm failed for '{topic}': {e}")
+
+    def run(self):
+        self.warm(self.topics)
+        while not self.stopped.wait(self.interval):
+            topics = self.topics_to_warm()
+            with main.refreshing_caches():
+                self.warm(topics)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,152 @@
+# profiling.py - Per-stage CPU and memory profiling for the research pipeline
+import os
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# cProfile allows one active profiler at a time, so one stage in the process
+# is profiled at once. The lock is only ever tried, never waited on, so a
+# session is not held up behind another session's searches and LLM calls.
+_stage_lock = threading.Lock()
+
+# tracemalloc is process-global. It stays on while any profiler is open and
+# is stopped by the last one to close, unless something else had started it.
+_tracing_lock = threading.Lock()
+_tracing = {'profilers': 0, 'started': False}
+
+def _open_tracing(traceback_frames):
+    with _tracing_lock:
+        if _tracing['profilers'] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(traceback_frames)
+            _tracing['started'] = True
+        _tracing['profilers'] += 1
+
+def _close_tracing():
+    with _tracing_lock:
+        _tracing['profilers'] -= 1
+        if _tracing['profilers'] == 0 and _tracing['started']:
+            tracemalloc.stop()
+            _tracing['started'] = False
+
+class StageProfiler:
+    """Collect cProfile and tracemalloc data for named pipeline stages
+
+    Wrap each stage in `with profiler.stage("name"):`. A stage can be entered
+    many times and its numbers accumulate. write() saves, per stage:
+      - <stage>.prof          pstats call stats (snakeviz, flameprof, gprof2dot)
+      - <stage>.alloc.folded  allocation stacks in folded format (flamegraph.pl, speedscope)
+    Allocation sizes are the net bytes still held when the stage exits.
+    Only one stage in the process is profiled at a time. A stage entered
+    while another profiler's stage runs is not profiled, and is counted in
+    `skipped` instead. Call close(), or write(), when done.
+    """
+
+    def __init__(self, output_dir="profiles", traceback_frames=25):
+        self.output_dir = output_dir
+        self.traceback_frames = traceback_frames
+        self.profiles = {}
+        self.allocations = {}
+        self.allocation_sites = Counter()
+        self.skipped = Counter()
+        self._active = None
+        self._tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        # cProfile cannot run nested profilers, so inner stages count towards the outer one
+        if self._active is not None:
+            yield
+            return
+
+        if not _stage_lock.acquire(blocking=False):
+            # Another session's stage is being profiled
+            self.skipped[name] += 1
+            yield
+            return
+        try:
+            with self._profiled(name):
+                yield
+        finally:
+            _stage_lock.release()
+
+    @contextmanager
+    def _profiled(self, name):
+        if not self._tracing:
+            _open_tracing(self.traceback_frames)
+            self._tracing = True
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        self._active = name
+        before = tracemalloc.take_snapshot()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+            self._active = None
+            self._record_allocations(name, before, after)
+
+    def _record_allocations(self, name, before, after):
+        stacks = self.allocations.setdefault(name, Counter())
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        for diff in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'traceback'):
+            if diff.size_diff <= 0:
+                continue
+            # Folded stacks run from the outermost frame to the allocation site
+            frames = [f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in diff.traceback]
+            stacks[";".join([name] + frames)] += diff.size_diff
+            site = diff.traceback[-1]
+            self.allocation_sites[(name, f"{site.filename}:{site.lineno}")] += diff.size_diff
+
+    def close(self):
+        """Release memory tracing; safe to call more than once"""
+        if self._tracing:
+            self._tracing = False
+            _close_tracing()
+
+    def write(self):
+        """Write per-stage profile files and return the paths written"""
+        self.close()
+        os.makedirs(self.output_dir, exist_ok=True)
+        paths = []
+        for name, profile in self.profiles.items():
+            path = os.path.join(self.output_dir, f"{name}.prof")
+            profile.dump_stats(path)
+            paths.append(path)
+        for name, stacks in self.allocations.items():
+            path = os.path.join(self.output_dir, f"{name}.alloc.folded")
+            with open(path, "w") as folded:
+                for stack, size in stacks.most_common():
+                    folded.write(f"{stack} {size}\n")
+            paths.append(path)
+        return paths
+
+    def summary(self, top=10):
+        """Return the top offenders by own CPU time and by allocated bytes"""
+        lines = ["Time per stage:"]
+        rows = []
+        for name, profile in self.profiles.items():
+            stats = pstats.Stats(profile)
+            lines.append(f"  {stats.total_tt * 1000:9.2f} ms  [{name}]")
+            for (filename, lineno, function), (_, calls, own_time, cumulative, _) in stats.stats.items():
+                rows.append((own_time, cumulative, calls, name, f"{os.path.basename(filename)}:{lineno}({function})"))
+
+        lines.append(f"Top {top} functions by own time:")
+        for own_time, cumulative, calls, name, location in sorted(rows, reverse=True)[:top]:
+            lines.append(f"  {own_time * 1000:9.2f} ms own {cumulative * 1000:9.2f} ms cum {calls:7d} calls  [{name}] {location}")
+
+        lines.append(f"Top {top} allocation sites by bytes:")
+        for (name, location), size in self.allocation_sites.most_common(top):
+            lines.append(f"  {size / 1024:9.1f} KiB  [{name}] {location}")
+        if self.skipped:
+            lines.append("Not profiled, another session was profiling at the time:")
+            for name, count in self.skipped.items():
+                lines.append(f"  {count:5d} x  [{name}]")
+        return "\n".join(lines)
+
+def profile_stage(profiler, name):
+    """Context manager for a stage, or a no-op when profiling is off"""
+    return profiler.stage(name) if profiler is not None else nullcontext()
@@ -0,0 +1,36 @@
+# query_expansion.py - Local template-based search query expansion
+import re
+from intent import extract_research_topic
+
+# One query per research perspective, in search order. Criticisms and
+# benefits go first, so a search that stops after the minimum two still
+# hears both sides.
+PERSPECTIVES = ["criticisms", "benefits", "overview", "comparison"]
+QUERY_TEMPLATES = [
+    "{topic} problems criticisms",
+    "{topic} benefits advantages",
+    "{topic} overview history",
+    "{topic} vs competitors alternatives",
+]
+
+# A topic that already names its rivals only needs a comparison query
+COMPARISON_TEMPLATE = "{topic} comparison"
+RIVAL_WORDS = {'competitors', 'competition', 'rivals', 'alternatives', 'others'}
+
+# Quotes around the topic and trailing punctuation; apostrophes inside it
+# (McDonald's) are part of the name
+TOPIC_NOISE = re.compile(r"^[\"'`“”‘’]+|[\"'`“”‘’?.!,;:]+$")
+
+def normalize_topic(query):
+    """Reduce a user request to the bare topic used in search queries"""
+    topic = extract_research_topic(query.strip())
+    topic = TOPIC_NOISE.sub('', topic)
+    return " ".join(topic.split()) or query.strip()
+
+def expand_queries(query):
+    """Expand a topic into the four perspective queries without an LLM call"""
+    topic = normalize_topic(query)
+    templates = list(QUERY_TEMPLATES)
+    if RIVAL_WORDS & set(topic.lower().split()):
+        templates[-1] = COMPARISON_TEMPLATE
+    return [template.format(topic=topic) for template in templates]
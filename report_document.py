@@ -0,0 +1,447 @@
+# report_document.py - Shared document model for research reports
+import os
+import re
+import io
+import glob
+import html
+import time
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import namedtuple
+from functools import lru_cache
+from datetime import datetime
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
+from reportlab.platypus.tableofcontents import TableOfContents
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.colors import HexColor
+
+PAGE_MARGINS = dict(rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+# Conversation exports are temp files with this prefix; ones older than
+# EXPORT_MAX_AGE seconds are assumed abandoned and removed
+EXPORT_PREFIX = "research_conversation_"
+EXPORT_MAX_AGE = 3600
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+# A report is a tuple of blocks. Each block has a kind ("heading", "bullet",
+# "numbered", "table" or "paragraph"), a level (the heading level, the item
+# number of a numbered item, 0 otherwise) and a tuple of lines, where every
+# line is a tuple of (style, text) spans. A table has one line per row and
+# one span tuple per cell, and its first row is the header. A "link" span
+# holds a (label, url) pair instead of plain text.
+Block = namedtuple("Block", ["kind", "level", "lines"])
+
+# One alternation handles every inline construct, so each line is scanned once
+INLINE_PATTERN = re.compile(
+    r"(?P<link>\[(?P<label>[^\]]+)\]\((?P<href>https?://[^\s)]+)\))"
+    r"|(?P<url>https?://[^\s<>()\[\]]*[^\s<>()\[\].,;:!?'\"])"
+    r"|\*\*(?P<bold>.+?)\*\*"
+    r"|(?<!\w)\*(?P<italic>[^*\s][^*]*?)\*"
+    r"|`(?P<code>[^`]+)`"
+    r"|(?P<tag></?[a-zA-Z][^>]*>)"
+)
+HEADING_PATTERN = re.compile(r"(#{1,6})\s+(.*)")
+BULLET_PATTERN = re.compile(r"[-*•]\s+(.*)")
+NUMBERED_PATTERN = re.compile(r"(\d{1,3})[.)]\s+(.*)")
+TABLE_SEPARATOR_PATTERN = re.compile(r"\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?")
+BOLD_LINE_PATTERN = re.compile(r"\*\*([^*]+)\*\*:?")
+
+def parse_inline(text):
+    """Split a line of markdown into (style, text) spans"""
+    spans = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        if match.start() > position:
+            spans.append(("text", text[position:match.start()]))
+        style = match.lastgroup
+        if style == "link":
+            spans.append(("link", (match.group("label"), match.group("href"))))
+        elif style == "url":
+            # Bare URLs, e.g. in citations, become links to themselves
+            spans.append(("link", (match.group("url"), match.group("url"))))
+        elif style != "tag":  # Stray HTML tags are dropped
+            spans.append((style, match.group(style)))
+        position = match.end()
+    if position < len(text):
+        spans.append(("text", text[position:]))
+    return tuple(spans)
+
+def parse_table_row(line):
+    """Split a markdown table row into cells of spans"""
+    cells = line.strip().strip("|").split("|")
+    return tuple(parse_inline(cell.strip()) for cell in cells)
+
+@lru_cache(maxsize=256)
+def parse_report(markdown):
+    """Parse report markdown into a compact document model in a single pass"""
+    blocks = []
+    paragraph = []
+    table = []
+
+    def flush_paragraph():
+        if paragraph:
+            blocks.append(Block("paragraph", 0, tuple(paragraph)))
+            paragraph.clear()
+        if table:
+            blocks.append(Block("table", 0, tuple(table)))
+            table.clear()
+
+    for raw_line in markdown.splitlines():
+        line = raw_line.strip()
+        if not line:
+            flush_paragraph()
+            continue
+
+        if line.startswith("|"):
+            if paragraph:
+                flush_paragraph()
+            if not TABLE_SEPARATOR_PATTERN.fullmatch(line):
+                table.append(parse_table_row(line))
+            continue
+        if table:
+            flush_paragraph()
+
+        heading = HEADING_PATTERN.fullmatch(line)
+        if heading:
+            flush_paragraph()
+            blocks.append(Block("heading", len(heading.group(1)), (parse_inline(heading.group(2)),)))
+            continue
+
+        # A line that is bold and nothing else is used as a section title
+        bold_line = BOLD_LINE_PATTERN.fullmatch(line)
+        if bold_line:
+            flush_paragraph()
+            blocks.append(Block("heading", 3, (parse_inline(bold_line.group(1)),)))
+            continue
+
+        bullet = BULLET_PATTERN.fullmatch(line)
+        if bullet:
+            flush_paragraph()
+            blocks.append(Block("bullet", 0, (parse_inline(bullet.group(1)),)))
+            continue
+
+        numbered = NUMBERED_PATTERN.fullmatch(line)
+        if numbered:
+            flush_paragraph()
+            blocks.append(Block("numbered", int(numbered.group(1)), (parse_inline(numbered.group(2)),)))
+            continue
+
+        paragraph.append(parse_inline(line))
+
+    flush_paragraph()
+    return tuple(blocks)
+
+HTML_SPAN_TAGS = {"bold": "strong", "italic": "em", "code": "code"}
+
+def _html_line(spans):
+    parts = []
+    for style, text in spans:
+        if style == "link":
+            label, url = text
+            parts.append(f'<a href="{html.escape(url)}" target="_blank">{html.escape(label)}</a>')
+            continue
+        text = html.escape(text)
+        tag = HTML_SPAN_TAGS.get(style)
+        parts.append(f"<{tag}>{text}</{tag}>" if tag else text)
+    return "".join(parts)
+
+def _html_table(rows):
+    header = "".join(f"<th>{_html_line(cell)}</th>" for cell in rows[0])
+    body = "".join("<tr>" + "".join(f"<td>{_html_line(cell)}</td>" for cell in row) + "</tr>" for row in rows[1:])
+    return f"<table><thead><tr>{header}</tr></thead><tbody>{body}</tbody></table>"
+
+def render_html(document):
+    """Render a parsed report as HTML for the chat view"""
+    parts = []
+    items = []
+    list_kind = None
+
+    def flush_list():
+        if items:
+            if list_kind == "bullet":
+                parts.append(f"<ul>{''.join(items)}</ul>")
+            else:
+                parts.append(f'<ol start="{list_start}">{"".join(items)}</ol>')
+            items.clear()
+
+    for block in document:
+        if block.kind in ("bullet", "numbered"):
+            if block.kind != list_kind:
+                flush_list()
+                list_kind = block.kind
+                list_start = block.level
+            items.append(f"<li>{_html_line(block.lines[0])}</li>")
+            continue
+        flush_list()
+        list_kind = None
+        if block.kind == "heading":
+            level = min(block.level + 2, 6)
+            parts.append(f"<h{level}>{_html_line(block.lines[0])}</h{level}>")
+        elif block.kind == "table":
+            parts.append(_html_table(block.lines))
+        else:
+            parts.append(f"<p>{'<br>'.join(_html_line(line) for line in block.lines)}</p>")
+    flush_list()
+    return "".join(parts)
+
+@lru_cache(maxsize=256)
+def markdown_to_html(markdown):
+    """Parse and render markdown to HTML, cached per distinct string"""
+    return render_html(parse_report(markdown))
+
+PDF_SPAN_TAGS = {"bold": ("<b>", "</b>"), "italic": ("<i>", "</i>"), "code": ('<font face="Courier">', "</font>")}
+
+def _pdf_line(spans):
+    parts = []
+    for style, text in spans:
+        if style == "link":
+            label, url = text
+            parts.append(f'<link href="{html.escape(url)}" color="#2c5aa0">{html.escape(label, quote=False)}</link>')
+            continue
+        text = html.escape(text, quote=False)
+        opening, closing = PDF_SPAN_TAGS.get(style, ("", ""))
+        parts.append(f"{opening}{text}{closing}")
+    return "".join(parts)
+
+def _pdf_table(rows, body_style):
+    columns = max(len(row) for row in rows)
+    # Pad short rows so every row has a cell per column
+    data = [[Paragraph(_pdf_line(cell), body_style) for cell in row] + [""] * (columns - len(row)) for row in rows]
+    table = Table(data, repeatRows=1, hAlign="LEFT")
+    table.setStyle(TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.5, HexColor('#999999')),
+        ("BACKGROUND", (0, 0), (-1, 0), HexColor('#dce6f2')),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ]))
+    return table
+
+def build_flowables(document, heading_style, subheading_style, body_style):
+    """Convert a parsed report into ReportLab flowables"""
+    flowables = []
+    for block in document:
+        if block.kind == "heading":
+            style = heading_style if block.level <= 2 else subheading_style
+            flowables.append(Paragraph(_pdf_line(block.lines[0]), style))
+            flowables.append(Spacer(1, 6))
+        elif block.kind == "bullet":
+            flowables.append(Paragraph(f"• {_pdf_line(block.lines[0])}", body_style))
+        elif block.kind == "numbered":
+            flowables.append(Paragraph(f"{block.level}. {_pdf_line(block.lines[0])}", body_style))
+        elif block.kind == "table":
+            flowables.append(_pdf_table(block.lines, body_style))
+            flowables.append(Spacer(1, 8))
+        else:
+            flowables.append(Paragraph("<br/>".join(_pdf_line(line) for line in block.lines), body_style))
+            flowables.append(Spacer(1, 8))
+    return flowables
+
+def pdf_styles():
+    """Build the paragraph styles shared by every PDF export"""
+    # Get styles
+    styles = getSampleStyleSheet()
+
+    # Custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Title'],
+        fontSize=20,
+        spaceAfter=30,
+        textColor=HexColor('#1f4e79'),
+        alignment=1  # Center alignment
+    )
+
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading1'],
+        fontSize=14,
+        spaceAfter=12,
+        textColor=HexColor('#2c5aa0'),
+        keepWithNext=1
+    )
+
+    subheading_style = ParagraphStyle(
+        'CustomSubHeading',
+        parent=styles['Heading2'],
+        fontSize=12,
+        spaceAfter=8,
+        textColor=HexColor('#4472c4'),
+        keepWithNext=1
+    )
+
+    body_style = ParagraphStyle(
+        'CustomBody',
+        parent=styles['Normal'],
+        fontSize=10,
+        spaceAfter=8,
+        leading=14
+    )
+
+    meta_style = ParagraphStyle('Meta', parent=styles['Normal'], fontSize=9, textColor=HexColor('#666666'))
+
+    # Report titles in a combined export are picked up for the table of contents
+    toc_title_style = ParagraphStyle('TOCTitle', parent=heading_style)
+
+    return {
+        'title': title_style,
+        'heading': heading_style,
+        'subheading': subheading_style,
+        'body': body_style,
+        'meta': meta_style,
+        'toc_title': toc_title_style,
+        'footer': styles['Italic'],
+    }
+
+def clean_report_topic(topic):
+    """Turn the user's request into a short title for the PDF"""
+    clean_topic = re.sub(r"I'll research \*\*'([^']+)'\*\* for yo.*", r'\1', topic)
+    clean_topic = re.sub(r'[^\w\s-]', '', clean_topic).strip()
+    if not clean_topic or len(clean_topic) < 3:
+        clean_topic = "Research Report"
+    return clean_topic
+
+def report_story(research_content, topic, styles, in_toc=False):
+    """Build the flowables for one report, from title page to footer"""
+    # Content list
+    content = []
+
+    # Title page
+    content.append(Paragraph(f"Research Report", styles['title']))
+    content.append(Spacer(1, 12))
+    content.append(Paragraph(clean_report_topic(topic), styles['toc_title'] if in_toc else styles['heading']))
+    content.append(Spacer(1, 30))
+
+    # Metadata
+    content.append(Paragraph(f"Generated by AI Research Agent", styles['meta']))
+    content.append(Paragraph(f"Date: {datetime.now().strftime('%B %d, %Y')}", styles['meta']))
+    content.append(Spacer(1, 40))
+
+    # Render the report body from the shared document model
+    content.extend(build_flowables(parse_report(research_content), styles['heading'], styles['subheading'], styles['body']))
+
+    # Footer
+    content.append(Spacer(1, 30))
+    content.append(Paragraph("Generated by AI Research Agent - Comprehensive Multi-Perspective Analysis", styles['footer']))
+    return content
+
+def generate_pdf_report(research_content, topic, user_query):
+    """Generate a professional PDF report from research content"""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, **PAGE_MARGINS)
+
+    # Build PDF
+    doc.build(report_story(research_content, topic, pdf_styles()))
+    buffer.seek(0)
+    return buffer
+
+def render_pdf_bytes(research_content, topic, user_query):
+    """Worker entry point - build one report PDF and return its bytes"""
+    return generate_pdf_report(research_content, topic, user_query).getvalue()
+
+def write_pdf_file(research_content, topic, user_query, path):
+    """Worker entry point - build one report PDF straight to a file"""
+    doc = SimpleDocTemplate(path, pagesize=A4, **PAGE_MARGINS)
+    doc.build(report_story(research_content, topic, pdf_styles()))
+    return path
+
+class ConversationDocTemplate(SimpleDocTemplate):
+    """Document that lists every report title in its table of contents"""
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, Paragraph) and flowable.style.name == 'TOCTitle':
+            self.notify('TOCEntry', (0, flowable.getPlainText(), self.page))
+
+def write_conversation_pdf(reports, path):
+    """Worker entry point - build every report into one PDF with a table of contents"""
+    styles = pdf_styles()
+    toc = TableOfContents()
+    toc.levelStyles = [ParagraphStyle('TOCLevel0', parent=styles['body'], fontSize=11, leftIndent=20, firstLineIndent=-20)]
+
+    content = [Paragraph("Research Conversation", styles['title']), Paragraph("Contents", styles['heading']), toc]
+    for research_content, topic, _ in reports:
+        content.append(PageBreak())
+        content.extend(report_story(research_content, topic, styles, in_toc=True))
+
+    doc = ConversationDocTemplate(path, pagesize=A4, **PAGE_MARGINS)
+    # Two passes, so the table of contents knows every page number
+    doc.multiBuild(content)
+    return path
+
+def get_pdf_pool():
+    """Return the shared process pool that builds PDFs off the script thread"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # Spawned workers only import this module, not the Streamlit app
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+def submit_pdf_job(function, *args):
+    """Run a worker entry point in the PDF pool and return its future
+
+    Daemonic processes (e.g. multiprocessing.Pool workers, as in
+    load_test.py) cannot start child processes, so there the job runs
+    in-process and the returned future is already done.
+    """
+    if not multiprocessing.current_process().daemon:
+        return get_pdf_pool().submit(function, *args)
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def submit_pdf_report(research_content, topic, user_query):
+    """Start building a report PDF in the pool and return a future of its bytes"""
+    return submit_pdf_job(render_pdf_bytes, research_content, topic, user_query)
+
+def write_conversation_zip(reports, path):
+    """Build each report as its own PDF in the pool and zip them into `path`"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        jobs = []
+        for index, (research_content, topic, user_query) in enumerate(reports, 1):
+            slug = re.sub(r'\W+', '_', clean_report_topic(topic)).strip('_').lower()
+            name = f"{index:02d}_{slug}.pdf"
+            jobs.append((name, submit_pdf_job(write_pdf_file, research_content, topic, user_query, os.path.join(work_dir, name))))
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, job in jobs:
+                archive.write(job.result(), arcname=name)
+    return path
+
+def export_conversation(reports, path, export_format="pdf"):
+    """Start exporting every (content, topic, user_query) report to `path`
+
+    "pdf" builds one combined PDF with a table of contents in a worker
+    process. "zip" builds each report as its own PDF in parallel and adds
+    them to a zip archive file by file, from a background thread. Returns
+    a future of the path written.
+    """
+    if export_format == "pdf":
+        return submit_pdf_job(write_conversation_pdf, list(reports), path)
+
+    future = Future()
+
+    def build_zip():
+        try:
+            future.set_result(write_conversation_zip(list(reports), path))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=build_zip, name="conversation-zip", daemon=True).start()
+    return future
+
+def remove_stale_exports(max_age=EXPORT_MAX_AGE):
+    """Delete conversation exports older than max_age seconds, e.g. left by closed sessions"""
+    cutoff = time.time() - max_age
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{EXPORT_PREFIX}*")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # Already removed by another session